@@ -36,6 +36,7 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.TemplateHTMLRenderer',
         'wq.db.rest.renderers.JSONRenderer',
         'wq.db.rest.renderers.GeoJSONRenderer',
+        'wq.db.rest.renderers.TopoJSONRenderer',
     ),
 
     'DEFAULT_PAGINATION_CLASS': 'wq.db.rest.pagination.Pagination',
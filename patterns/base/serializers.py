@@ -1,4 +1,5 @@
 from wq.db.rest.serializers import ModelSerializer
+from wq.db.rest.renderers import RawJSON
 from rest_framework import serializers
 from wq.db.rest.models import get_ct, get_object_id
 
@@ -8,7 +9,10 @@ class AttachmentListSerializer(serializers.ListSerializer):
         data = super(AttachmentListSerializer, self).to_representation(data)
         if self.parent:
             for i, row in enumerate(data):
-                row['@index'] = i
+                if isinstance(row, RawJSON):
+                    data[i] = row.with_member('@index', i)
+                else:
+                    row['@index'] = i
         return data
 
 
@@ -132,6 +136,19 @@ class AttachedModelSerializer(ModelSerializer):
                     self.create_attachment(model, attachment, name)
         return obj
 
+    def build_instance(self, validated_data, instance=None):
+        cls = type(self)
+        if (cls.create != AttachedModelSerializer.create or
+                cls.update != AttachedModelSerializer.update or
+                cls.save != AttachedModelSerializer.save):
+            return None
+        model_data, attachment_data = self.extract_attachments(
+            dict(validated_data)
+        )
+        if any(attachment_data.values()):
+            return None
+        return self.build_model_instance(model_data, instance)
+
     def extract_attachments(self, validated_data):
         fields = self.get_fields()
         attachment_data = {}
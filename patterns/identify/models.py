@@ -170,6 +170,28 @@ class IdentifiedModelManager(NaturalKeyModelManager):
 
         return obj
 
+    def get_pks_by_identifiers(self, identifiers):
+        """
+        Batch version of get_by_identifier(), returning a dict mapping
+        each identifier that was found to a primary key.  Uses one query
+        per search rather than one per identifier.
+        """
+        searches = [
+            'slug', 'name', 'identifiers__slug', 'identifiers__name',
+        ]
+        matches = {}
+        remaining = set(identifiers)
+        for search in searches:
+            if not remaining:
+                break
+            found = self.filter(**{
+                search + '__in': remaining
+            }).order_by('pk').values_list(search, 'pk')
+            for ident, pk in found:
+                matches.setdefault(ident, pk)
+            remaining.difference_update(matches)
+        return matches
+
     def get_by_natural_key(self, identifier):
         return self.get_by_identifier(identifier)
 
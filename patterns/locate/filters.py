@@ -0,0 +1,119 @@
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.exceptions import ValidationError
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.contrib.gis.geos import GEOSGeometry, GEOSException, Point, Polygon
+try:
+    from django.contrib.gis.gdal.error import GDALException
+except ImportError:
+    # Django < 1.9
+    from django.contrib.gis.gdal.error import OGRException as GDALException
+
+from wq.db.rest.models import get_ct
+from wq.db.rest.tiles import get_tile_source, get_distance_sql
+
+
+class SpatialFilterBackend(BaseFilterBackend):
+    """
+    Filter models with a geometry field (or locations) by map extent:
+
+        ?bbox=minx,miny,maxx,maxy[,srid]
+        ?intersects=<GeoJSON geometry>
+        ?dwithin=x,y,distance[,srid]  (distance in units of the field SRID)
+        ?near=x,y[,srid]              (nearest first, with distances)
+
+    For located models the lookups are applied to wq_location as a subquery
+    so they can use its spatial and (content_type, object_id) indexes.
+    """
+    params = ('bbox', 'intersects', 'dwithin')
+    default_srid = 4326
+
+    def filter_queryset(self, request, queryset, view):
+        source = get_tile_source(queryset.model)
+        if not source:
+            return queryset
+        queryset = self.filter_extent(request, queryset, view, source)
+        near = request.GET.get('near', None)
+        if near and 'near' not in getattr(view, 'ignore_kwargs', []):
+            queryset = self.filter_near(request, queryset, view, near)
+        return queryset
+
+    def filter_extent(self, request, queryset, view, source):
+        relation, field = source
+
+        filter = {}
+        for param in self.params:
+            if param in getattr(view, 'ignore_kwargs', []):
+                continue
+            value = request.GET.get(param, None)
+            if value is None or value == '':
+                continue
+            lookup, arg = getattr(self, 'parse_%s' % param)(value)
+            filter['%s__%s' % (field.name, lookup)] = arg
+        if not filter:
+            return queryset
+
+        if not relation:
+            return queryset.filter(**filter)
+
+        locations = relation.rel.to._default_manager.filter(**{
+            relation.content_type_field_name: get_ct(
+                queryset.model, for_concrete_model=True
+            ),
+        }).filter(**filter)
+        return queryset.filter(
+            pk__in=locations.values(relation.object_id_field_name)
+        )
+
+    def filter_near(self, request, queryset, view, value):
+        """
+        Order the queryset by distance (in meters) from the given point.
+        Paging is left to the paginator, so the count covers every row;
+        the distances are added to each row by the view (see
+        LocatedModelViewSet.add_list_context()).
+        """
+        if connections[queryset.db].vendor != 'postgresql':
+            raise ValidationError({'near': 'Not supported by this database'})
+        (x, y), srid = self.parse_numbers('near', value, 2)
+        sql, params = get_distance_sql(queryset, Point(x, y, srid=srid))
+        queryset = queryset.annotate(
+            wq_near_distance=RawSQL(sql, params, output_field=FloatField())
+        ).order_by('wq_near_distance', 'pk')
+        view.near_queryset = queryset
+        return queryset
+
+    def parse_numbers(self, param, value, count):
+        try:
+            numbers = [float(num) for num in value.split(',')]
+        except ValueError:
+            numbers = []
+        if len(numbers) not in (count, count + 1):
+            raise ValidationError({
+                param: 'Expected %s comma-separated numbers (and SRID)'
+                       % count
+            })
+        if len(numbers) > count:
+            srid = int(numbers.pop())
+        else:
+            srid = self.default_srid
+        return numbers, srid
+
+    def parse_bbox(self, value):
+        bounds, srid = self.parse_numbers('bbox', value, 4)
+        bbox = Polygon.from_bbox(bounds)
+        bbox.srid = srid
+        return 'intersects', bbox
+
+    def parse_intersects(self, value):
+        try:
+            geometry = GEOSGeometry(value)
+        except (ValueError, GEOSException, GDALException):
+            raise ValidationError({'intersects': 'Invalid geometry'})
+        if geometry.srid is None:
+            geometry.srid = self.default_srid
+        return 'intersects', geometry
+
+    def parse_dwithin(self, value):
+        (x, y, distance), srid = self.parse_numbers('dwithin', value, 3)
+        return 'dwithin', (Point(x, y, srid=srid), distance)
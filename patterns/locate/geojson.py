@@ -0,0 +1,315 @@
+import codecs
+import json
+import re
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.encoding import force_text
+
+from wq.db.rest.models import get_ct, get_by_identifier
+from .models import Location, PrimaryLocation, get_primary_location_types
+
+
+class FeatureReader(object):
+    """
+    Incrementally parse a GeoJSON FeatureCollection from a file object,
+    yielding one feature at a time so that large files never need to fit
+    in memory.  Top-level members other than "features" (e.g. "crs") are
+    saved as attributes once they have been read.
+
+    A value that still cannot be parsed once max_value_size characters
+    have been buffered is treated as malformed, rather than reading the
+    rest of the file into memory looking for its end.
+    """
+    whitespace = ' \t\r\n'
+    structure = re.compile(r'["\\{}\[\]]')
+
+    def __init__(self, stream, chunk_size=65536,
+                 max_value_size=16 * 1024 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.members = {}
+
+    @property
+    def crs(self):
+        return self.members.get('crs', None)
+
+    def read_more(self):
+        if self.eof:
+            return False
+        chunk = None
+        while not chunk:
+            data = self.stream.read(self.chunk_size)
+            if not data:
+                self.eof = True
+                return False
+            if isinstance(data, bytes):
+                # May be empty if data ends within a multibyte character
+                chunk = self.text_decoder.decode(data)
+            else:
+                chunk = data
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while (self.pos < len(self.buffer) and
+                    self.buffer[self.pos] in self.whitespace):
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.read_more():
+                return
+
+    def expect(self, chars):
+        self.skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise ValueError("Unexpected end of GeoJSON")
+        char = self.buffer[self.pos]
+        if char not in chars:
+            raise ValueError("Expected %s in GeoJSON, found %s" % (
+                ' or '.join(chars), char
+            ))
+        self.pos += 1
+        return char
+
+    def find_end(self):
+        """
+        Scan ahead (reading more data as needed) to the end of the object
+        or array starting at pos, so that it only needs to be decoded once.
+        Scanning resumes where it left off after each read, so this is
+        linear in the size of the value.  Returns False if the data ended
+        first.
+        """
+        depth = 0
+        in_string = False
+        offset = 0
+        while True:
+            buffer = self.buffer
+            match = self.structure.search(buffer, self.pos + offset)
+            while match:
+                char = match.group(0)
+                index = match.end()
+                if in_string:
+                    if char == '\\':
+                        # Skip the escaped character
+                        index += 1
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char in '{[':
+                    depth += 1
+                elif char in '}]':
+                    depth -= 1
+                    if depth == 0:
+                        return True
+                if index > len(buffer):
+                    # Escaped character is in the next chunk
+                    break
+                match = self.structure.search(buffer, index)
+            else:
+                index = len(buffer)
+            offset = index - self.pos
+            if offset > self.max_value_size:
+                raise ValueError(
+                    "GeoJSON value larger than %s characters"
+                    % self.max_value_size
+                )
+            if not self.read_more():
+                # Incomplete; let the decoder report the error
+                return False
+
+    def decode(self):
+        self.skip_whitespace()
+        complete = False
+        if self.buffer[self.pos:self.pos + 1] in ('{', '['):
+            complete = self.find_end()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as e:
+                if complete:
+                    raise
+                # Value may be incomplete
+                if len(self.buffer) - self.pos > self.max_value_size:
+                    raise ValueError(
+                        "Invalid GeoJSON value (or larger than %s "
+                        "characters): %s" % (self.max_value_size, e)
+                    )
+                if self.read_more():
+                    continue
+                raise
+            # Make sure a number was not cut off at the end of the buffer
+            if end >= len(self.buffer) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self.expect('{')
+        self.skip_whitespace()
+        if self.buffer[self.pos:self.pos + 1] == '}':
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            if key == 'features':
+                self.expect('[')
+                self.skip_whitespace()
+                if self.buffer[self.pos:self.pos + 1] == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self.decode()
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.members[key] = self.decode()
+            if self.expect(',}') == '}':
+                return
+
+
+def get_feature_srid(feature, crs=None, default=4326):
+    crs = feature.get('crs', None) or crs
+    if crs and crs.get('type', None) == 'name':
+        name = crs['properties']['name']
+        for prefix in ('urn:ogc:def:crs:EPSG::', 'EPSG:'):
+            if name.startswith(prefix):
+                return int(name.replace(prefix, ''))
+    return default
+
+
+def get_feature_identifier(feature, property=None):
+    if property:
+        ident = (feature.get('properties') or {}).get(property, None)
+    else:
+        ident = feature.get('id', None)
+    if ident is None:
+        return None
+    return force_text(ident)
+
+
+def match_identifiers(model, identifiers):
+    """
+    Map identifiers (as text) to primary keys, with one query for models
+    that are looked up by a field.  Managers can provide a batch lookup via
+    get_pks_by_identifiers(); other managers with get_by_identifier() are
+    queried once per identifier.
+    """
+    from wq.db import rest  # avoid circular import
+    lookup = rest.router.get_lookup_for_model(model)
+    manager = model._default_manager
+    identifiers = set(ident for ident in identifiers if ident is not None)
+    if hasattr(manager, 'get_pks_by_identifiers'):
+        return manager.get_pks_by_identifiers(identifiers)
+    if hasattr(manager, 'get_by_identifier'):
+        matches = {}
+        for ident in identifiers:
+            try:
+                matches[ident] = get_by_identifier(manager, ident).pk
+            except model.DoesNotExist:
+                pass
+        return matches
+
+    if lookup == 'pk':
+        field = model._meta.pk
+    else:
+        field = model._meta.get_field(lookup)
+    values = []
+    for ident in identifiers:
+        try:
+            values.append(field.to_python(ident))
+        except ValidationError:
+            pass
+    return {
+        force_text(ident): pk for ident, pk in manager.filter(**{
+            lookup + '__in': values
+        }).values_list(lookup, 'pk')
+    }
+
+
+def import_locations(features, model, property=None, srid=4326,
+                     batch_size=500, offset=0, progress=None):
+    """
+    Create Location rows for a stream of GeoJSON features, matching each
+    feature to an instance of model by its id (or the given property).
+
+    features can be a FeatureReader, in which case its crs (if any) is
+    used for features without their own.  Features are written with
+    bulk_create() in transactions of batch_size.
+    Geometries keep their source SRID, so the database transforms them as
+    part of each INSERT.  The first offset features are skipped, so an
+    interrupted import can be resumed from the last reported offset.
+    progress (if given) is called with a dict of counts after each batch.
+    """
+    ct = get_ct(model, for_concrete_model=True)
+    stats = {'offset': 0, 'created': 0, 'unmatched': 0}
+    batch = []
+
+    def save(batch):
+        matches = match_identifiers(model, [
+            get_feature_identifier(feature, property) for feature in batch
+        ])
+        crs = getattr(features, 'crs', None)
+        locations = []
+        for feature in batch:
+            ident = get_feature_identifier(feature, property)
+            props = feature.get('properties') or {}
+            if ident not in matches or not feature.get('geometry'):
+                stats['unmatched'] += 1
+                continue
+            geometry = GEOSGeometry(json.dumps(feature['geometry']))
+            geometry.srid = get_feature_srid(feature, crs, srid)
+            locations.append(Location(
+                content_type=ct,
+                object_id=matches[ident],
+                name=props.get('name', None),
+                is_primary=bool(props.get('is_primary', False)),
+                accuracy=props.get('accuracy', None),
+                geometry=geometry,
+            ))
+        with transaction.atomic():
+            Location.objects.bulk_create(locations)
+            record_bulk_changes(model, ct, set(
+                location.object_id for location in locations
+            ))
+        stats['created'] += len(locations)
+        stats['offset'] += len(batch)
+        if progress:
+            progress(dict(stats))
+
+    for i, feature in enumerate(features):
+        if i < offset:
+            stats['offset'] += 1
+            continue
+        batch.append(feature)
+        if len(batch) >= batch_size:
+            save(batch)
+            batch = []
+    if batch:
+        save(batch)
+    return stats
+
+
+def record_bulk_changes(model, ct, object_ids):
+    """
+    Do the work of the Location signals (which bulk_create() skips) once
+    per batch.
+    """
+    from wq.db import rest  # avoid circular import
+    from wq.db.rest.models import Change
+    if not object_ids:
+        return
+    if ct.pk in get_primary_location_types():
+        PrimaryLocation.objects.update_many(ct.pk, object_ids)
+    if rest.router.model_is_synced(model):
+        for object_id in object_ids:
+            Change.objects.set_change(ct.pk, object_id, is_parent=True)
+    rest.router.invalidate_cache(Location)
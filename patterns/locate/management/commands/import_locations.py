@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.apps import apps
+from wq.db.patterns.locate.geojson import FeatureReader, import_locations
+import io
+import sys
+
+
+class Command(BaseCommand):
+    help = "Import a (large) GeoJSON FeatureCollection as Location rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model',
+            help="Located model to attach locations to (app_label.Model)",
+        )
+        parser.add_argument(
+            'filename',
+            help="GeoJSON file to import (or - for stdin)",
+        )
+        parser.add_argument(
+            '--property',
+            default=None,
+            help="Feature property to match to the model's lookup field "
+                 "(default: the feature id)",
+        )
+        parser.add_argument(
+            '--srid',
+            type=int,
+            default=4326,
+            help="SRID of features without a crs (default: 4326)",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of features to save per transaction",
+        )
+        parser.add_argument(
+            '--max-feature-size',
+            type=int,
+            default=16 * 1024 * 1024,
+            help="Largest feature to parse, in characters (features that "
+                 "cannot be parsed within this size are reported as invalid)",
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            default=0,
+            help="Skip this many features (to resume an interrupted import)",
+        )
+
+    def handle(self, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if options['filename'] == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        else:
+            stream = io.open(options['filename'], 'rb')
+
+        # Offset of the last saved batch
+        saved = {'offset': options['offset']}
+
+        def progress(stats):
+            saved.update(stats)
+            self.stdout.write(
+                "%(offset)s features read, %(created)s locations created, "
+                "%(unmatched)s unmatched" % stats
+            )
+
+        try:
+            import_locations(
+                FeatureReader(
+                    stream, max_value_size=options['max_feature_size']
+                ),
+                model,
+                property=options['property'],
+                srid=options['srid'],
+                batch_size=options['batch_size'],
+                offset=options['offset'],
+                progress=progress,
+            )
+        except Exception as e:
+            raise CommandError(
+                "%s\nImport stopped; use --offset %s to resume." % (
+                    e, saved['offset']
+                )
+            )
+        finally:
+            if options['filename'] != '-':
+                stream.close()
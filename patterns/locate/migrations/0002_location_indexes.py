@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_spatial_index(apps, schema_editor):
+    # GeometryField(spatial_index=True) normally creates this already; make
+    # sure it exists for tables created some other way (e.g. legacy wq.db)
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    Location = apps.get_model('locate', 'Location')
+    table = Location._meta.db_table
+    column = Location._meta.get_field('geometry').column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            JOIN pg_attribute a
+              ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = %s::regclass
+              AND i.indnatts = 1
+              AND a.attname = %s
+              AND am.amname = 'gist'
+            """,
+            [connection.ops.quote_name(table), column]
+        )
+        if cursor.fetchone():
+            return
+    qn = schema_editor.quote_name
+    schema_editor.execute('CREATE INDEX %s ON %s USING GIST (%s)' % (
+        qn('%s_%s_gist' % (table, column)), qn(table), qn(column),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('locate', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='location',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunPython(create_spatial_index, migrations.RunPython.noop),
+    ]
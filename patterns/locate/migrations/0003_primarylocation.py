@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+from django.conf import settings
+SRID = getattr(settings, 'SRID', 4326)
+
+
+def populate_primary_locations(apps, schema_editor):
+    Location = apps.get_model('locate', 'Location')
+    PrimaryLocation = apps.get_model('locate', 'PrimaryLocation')
+    locations = Location.objects.order_by(
+        'content_type', 'object_id', '-is_primary', 'pk'
+    )
+    rows = []
+    last = None
+    for location in locations.iterator():
+        key = (location.content_type_id, location.object_id)
+        if key == last:
+            continue
+        last = key
+        rows.append(PrimaryLocation(
+            content_type_id=location.content_type_id,
+            object_id=location.object_id,
+            geometry=location.geometry,
+            centroid=location.geometry.centroid,
+        ))
+        if len(rows) >= 500:
+            PrimaryLocation.objects.bulk_create(rows)
+            rows = []
+    if rows:
+        PrimaryLocation.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('locate', '0002_location_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrimaryLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(srid=SRID)),
+                ('centroid', django.contrib.gis.db.models.fields.PointField(srid=SRID)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'abstract': False,
+                'db_table': 'wq_primarylocation',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='primarylocation',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunPython(
+            populate_primary_locations, migrations.RunPython.noop
+        ),
+    ]
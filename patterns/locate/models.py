@@ -1,5 +1,6 @@
 from django.contrib.gis.db import models
 from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.contrib.contenttypes.fields import (
     GenericForeignKey, GenericRelation
 )
@@ -30,10 +31,112 @@ class Location(models.Model):
     class Meta:
         db_table = 'wq_location'
         abstract = not INSTALLED
+        index_together = [('content_type', 'object_id')]
+
+
+class PrimaryLocationManager(models.GeoManager):
+    def update_for(self, content_type_id, object_id):
+        self.update_many(content_type_id, [object_id])
+
+    def update_many(self, content_type_id, object_ids):
+        """
+        Copy the primary (or else the first) location of each object, and
+        remove rows for objects that no longer have any locations.
+        """
+        self.filter(
+            content_type_id=content_type_id, object_id__in=object_ids,
+        ).delete()
+        locations = Location.objects.filter(
+            content_type_id=content_type_id, object_id__in=object_ids,
+        ).order_by('object_id', '-is_primary', 'pk')
+        rows = []
+        for location in locations:
+            if rows and rows[-1].object_id == location.object_id:
+                continue
+            rows.append(self.model(
+                content_type_id=content_type_id,
+                object_id=location.object_id,
+                geometry=location.geometry,
+                centroid=location.geometry.centroid,
+            ))
+        self.bulk_create(rows)
+
+
+class PrimaryLocation(models.Model):
+    """
+    Denormalized copy of the primary location of each located object, kept
+    up to date by Location signals.  Allows map lists to render one
+    geometry per object with a single join (see LocatedModelSerializer).
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    geometry = models.GeometryField(srid=SRID)
+    centroid = models.PointField(srid=SRID)
+
+    objects = PrimaryLocationManager()
+
+    class Meta:
+        db_table = 'wq_primarylocation'
+        abstract = not INSTALLED
+        unique_together = [('content_type', 'object_id')]
+
+
+def get_primary_location_types():
+    """
+    Content type ids of the models registered with primary_location, the
+    only ones whose PrimaryLocation rows are kept up to date by the
+    Location signals.
+    """
+    from wq.db import rest  # avoid circular import
+    return set(
+        ContentType.objects.get_for_model(model).pk
+        for model, config in rest.router._config.items()
+        if config.get('primary_location')
+    )
+
+
+def remember_location_parent(sender, instance, **kwargs):
+    # Locations can be moved to another object, in which case the previous
+    # object's PrimaryLocation needs to be updated as well.
+    instance._primary_location_parent = None
+    if instance.pk is None or not get_primary_location_types():
+        return
+    instance._primary_location_parent = Location.objects.filter(
+        pk=instance.pk
+    ).values_list('content_type_id', 'object_id').first()
+
+
+def update_primary_location(sender, instance, **kwargs):
+    types = get_primary_location_types()
+    if not types:
+        return
+    parent = (instance.content_type_id, instance.object_id)
+    old_parent = getattr(instance, '_primary_location_parent', None)
+    if parent[0] in types:
+        PrimaryLocation.objects.update_for(*parent)
+    if old_parent and tuple(old_parent) != parent and (
+            old_parent[0] in types):
+        PrimaryLocation.objects.update_for(*old_parent)
+
+
+if INSTALLED:
+    pre_save.connect(
+        remember_location_parent, sender=Location,
+        dispatch_uid='wq.db.patterns.locate.pre_save',
+    )
+    post_save.connect(
+        update_primary_location, sender=Location,
+        dispatch_uid='wq.db.patterns.locate.post_save',
+    )
+    post_delete.connect(
+        update_primary_location, sender=Location,
+        dispatch_uid='wq.db.patterns.locate.post_delete',
+    )
 
 
 class LocatedModel(models.Model):
     locations = GenericRelation(Location)
+    primary_location = GenericRelation(PrimaryLocation)
 
     class Meta:
         abstract = True
@@ -1,8 +1,12 @@
 from wq.db.rest.models import get_ct, get_object_id
+from wq.db.rest.renderers import RawJSON
+from wq.db.rest.serializers import (
+    GeometryField, GEOJSON_ANNOTATION, AsGeoJSON
+)
 from wq.db.patterns.base import serializers as base
 from django.utils.six import string_types
 import json
-from .models import Location
+from .models import Location, SRID
 
 
 class LocationListSerializer(base.AttachmentListSerializer):
@@ -67,7 +71,8 @@ class LocationSerializer(base.AttachmentSerializer):
             hasattr(self.parent.parent.Meta, 'model')
         )
         if self.as_geometry and has_parent:
-            return json.loads(loc.geometry.geojson)
+            field = self.fields['geometry']
+            return field.to_representation(field.get_attribute(loc))
 
         data = super(LocationSerializer, self).to_representation(loc)
         if has_parent:
@@ -96,9 +101,39 @@ class LocationSerializer(base.AttachmentSerializer):
         list_serializer_class = LocationListSerializer
 
 
+class PrimaryGeometryField(GeometryField):
+    """
+    Geometry copied from the object's PrimaryLocation, as annotated by
+    LocatedModelSerializer.get_query_annotations().
+    """
+    def get_attribute(self, instance):
+        geojson = getattr(
+            instance, GEOJSON_ANNOTATION % self.source_attrs[0], None
+        )
+        if geojson is None:
+            return None
+        return RawJSON(geojson)
+
+
 class LocatedModelSerializer(base.AttachedModelSerializer):
     locations = LocationSerializer(many=True)
 
+    @property
+    def primary_location(self):
+        """
+        The PrimaryLocation column ("geometry" or "centroid") to use for
+        GeoJSON lists, if the model was registered with primary_location.
+        """
+        if AsGeoJSON is None or not self.router:
+            return None
+        config = self.router.get_model_config(self.Meta.model) or {}
+        column = config.get('primary_location', None)
+        if column is True:
+            return 'geometry'
+        if column in ('geometry', 'centroid'):
+            return column
+        return None
+
     def get_fields(self):
         fields = super(LocatedModelSerializer, self).get_fields()
         if self.is_geojson:
@@ -106,6 +141,12 @@ class LocatedModelSerializer(base.AttachedModelSerializer):
             locations = fields.pop('locations')
             if self.is_edit:
                 name = 'features'
+            elif not self.is_detail and self.primary_location:
+                # Read from PrimaryLocation instead of all locations
+                fields['geometry'] = PrimaryGeometryField(
+                    source='primary_geometry', read_only=True
+                )
+                return fields
             else:
                 name = 'geometry'
                 locations.child.as_geometry = True
@@ -115,6 +156,20 @@ class LocatedModelSerializer(base.AttachedModelSerializer):
             fields.pop('locations')
         return fields
 
+    def get_query_annotations(self):
+        annotations = super(
+            LocatedModelSerializer, self
+        ).get_query_annotations()
+        field = self.fields.get('geometry', None)
+        if isinstance(field, PrimaryGeometryField):
+            annotations[GEOJSON_ANNOTATION % field.source] = (
+                self.get_geojson_annotation(
+                    'primary_location__' + self.primary_location, SRID,
+                    self.get_geometry_options(SRID),
+                )
+            )
+        return annotations
+
     class Meta:
         wq_config = {
             'map': True,
@@ -0,0 +1,29 @@
+from wq.db.rest.views import ModelViewSet
+from .filters import SpatialFilterBackend
+
+
+class LocatedModelViewSet(ModelViewSet):
+    filter_backends = ModelViewSet.filter_backends + [SpatialFilterBackend]
+    near_queryset = None
+
+    def stream_list(self):
+        if 'near' in self.request.GET:
+            # Nearest-neighbor lists are short and need distances added
+            return None
+        return super(LocatedModelViewSet, self).stream_list()
+
+    def add_list_context(self, response):
+        super(LocatedModelViewSet, self).add_list_context(response)
+        if self.near_queryset is None:
+            return
+        # Distances for the current page (see SpatialFilterBackend)
+        items = [
+            item for item in response.data.get('list', [])
+            if isinstance(item, dict)
+        ]
+        lookup = self.lookup_field
+        distances = dict(self.near_queryset.filter(**{
+            lookup + '__in': [item.get('id') for item in items]
+        }).values_list(lookup, 'wq_near_distance'))
+        for item in items:
+            item['distance'] = distances.get(item.get('id'))
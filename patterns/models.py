@@ -17,6 +17,7 @@ from .identify.models import (
 from .locate.models import (
     LocatedModel,
     Location,
+    PrimaryLocation,
 )
 from .mark.models import (
     MarkedModel,
@@ -47,6 +48,7 @@ __all__ = (
 
     'LocatedModel',
     'Location',
+    'PrimaryLocation',
 
     'MarkedModel',
     'MarkdownType',
@@ -1,4 +1,6 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.conf import settings
 
 
 class RestConfig(AppConfig):
@@ -6,3 +8,60 @@ class RestConfig(AppConfig):
 
     def ready(self):
         self.module.autodiscover()
+        compiled_config = getattr(settings, 'COMPILED_CONFIG', None)
+        if compiled_config:
+            self.module.router.load_compiled_config(compiled_config)
+        if apps.is_installed('django.contrib.auth'):
+            self.connect_permission_signals()
+        post_save.connect(
+            invalidate_response_cache, dispatch_uid='wq.db.rest.post_save'
+        )
+        post_delete.connect(
+            invalidate_response_cache, dispatch_uid='wq.db.rest.post_delete'
+        )
+        post_save.connect(
+            record_save, dispatch_uid='wq.db.rest.record_save'
+        )
+        post_delete.connect(
+            record_delete, dispatch_uid='wq.db.rest.record_delete'
+        )
+
+    def connect_permission_signals(self):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group
+        User = get_user_model()
+        relations = [Group.permissions]
+        for name in ('groups', 'user_permissions'):
+            if hasattr(User, name):
+                relations.append(getattr(User, name))
+        for relation in relations:
+            m2m_changed.connect(
+                reset_user_configs,
+                sender=relation.through,
+                dispatch_uid='wq.db.rest.%s' % relation.through.__name__,
+            )
+
+
+def reset_user_configs(sender, action, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    from .routers import router
+    router.reset_user_configs()
+
+
+def invalidate_response_cache(sender, raw=False, **kwargs):
+    if raw:
+        # Skip fixture loading
+        return
+    from .routers import router
+    router.invalidate_cache(sender)
+
+
+def record_save(sender, instance, **kwargs):
+    from .models import Change
+    Change.objects.record_change(instance)
+
+
+def record_delete(sender, instance, **kwargs):
+    from .models import Change
+    Change.objects.record_change(instance, deleted=True)
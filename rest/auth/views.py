@@ -11,11 +11,21 @@ class AuthView(SimpleViewSet):
     def user_info(self, request):
         user_dict = rest.router.serialize(request.user)
         user_dict['id'] = get_object_id(request.user)
-        return Response({
+        config_hash = rest.router.get_config_hash(request.user)
+        info = {
             'user': user_dict,
-            'config': rest.router.get_config(request.user),
+            'config_hash': config_hash,
             'csrftoken': csrf.get_token(request),
-        })
+        }
+
+        # Only send the full config if the client's copy is out of date
+        known_hash = (
+            request.GET.get('config_hash', None) or
+            request.POST.get('config_hash', None)
+        )
+        if known_hash != config_hash:
+            info['config'] = rest.router.get_config(request.user)
+        return Response(info)
 
     def csrf_info(self, request):
         response = {}
@@ -8,11 +8,16 @@ class Command(BaseCommand):
         parser.add_argument(
             '--format',
             default='json',
+            help="json, amd, or compiled (for settings.COMPILED_CONFIG)",
         )
 
     def handle(self, **options):
+        if options['format'] == "compiled":
+            data = rest.router.get_compiled_config_data()
+        else:
+            data = rest.router.get_config()
         text = json.dumps(
-            rest.router.get_config(),
+            data,
             indent=4,
         )
         if options['format'] == "amd":
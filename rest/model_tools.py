@@ -17,21 +17,14 @@ def get_ct(model, for_concrete_model=False):
 
 
 def get_object_id(instance):
-    ct = get_ct(instance)
-    config = ct.get_config()
-    if config and 'lookup' in config:
-        return getattr(instance, config['lookup'])
-    return instance.pk
+    from . import router  # avoid circular import
+    return getattr(instance, router.get_lookup_for_model(type(instance)))
 
 
 def get_by_identifier(queryset, ident):
     if hasattr(queryset, 'get_by_identifier'):
         return queryset.get_by_identifier(ident)
     else:
-        ct = get_ct(queryset.model)
-        config = ct.get_config()
-        if config and 'lookup' in config:
-            lookup = config['lookup']
-        else:
-            lookup = 'pk'
+        from . import router  # avoid circular import
+        lookup = router.get_lookup_for_model(queryset.model)
         return queryset.get(**{lookup: ident})
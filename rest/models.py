@@ -1,13 +1,20 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from django.contrib.contenttypes.models import (
     ContentType as DjangoContentType,
     ContentTypeManager as DjangoContentTypeManager
 )
+from django.contrib.contenttypes.fields import GenericForeignKey
 from django.utils.encoding import force_text
 from .model_tools import get_ct, get_object_id, get_by_identifier
 
 
 __all__ = (
     'ContentType',
+    'Change',
     'get_ct',
     'get_object_id',
     'get_by_identifier',
@@ -86,3 +93,114 @@ class ContentType(DjangoContentType):
 
     class Meta:
         proxy = True
+
+
+class ChangeManager(models.Manager):
+    def record_change(self, instance, deleted=False):
+        from . import router  # avoid circular import
+        model = type(instance)
+        if router.model_is_synced(model):
+            ct = get_ct(model, for_concrete_model=True)
+            self.set_change(
+                ct.pk, instance.pk,
+                get_object_id(instance) if deleted else None,
+            )
+
+        # Changes to attachments (identifiers, locations, etc.) count as
+        # changes to their parent object(s)
+        for field in get_generic_foreign_keys(model):
+            ct_id = getattr(instance, field.ct_field + '_id', None)
+            object_id = getattr(instance, field.fk_field, None)
+            if not ct_id or not object_id:
+                continue
+            parent_ct = DjangoContentType.objects.get_for_id(ct_id)
+            parent_model = parent_ct.model_class()
+            if parent_model and router.model_is_synced(parent_model):
+                self.set_change(ct_id, object_id, is_parent=True)
+
+    def set_change(self, ct_id, object_id, deleted_id=None, is_parent=False):
+        """
+        Record the latest change to an object, with a single UPDATE (or an
+        INSERT for the first change).  Changes to attachments (is_parent)
+        don't resurrect deleted parents (e.g. on cascade deletes).
+        """
+        values = {'date': timezone.now()}
+        if not is_parent:
+            values['deleted_id'] = deleted_id
+        if not self.filter(
+                content_type_id=ct_id, object_id=force_text(object_id)
+        ).update(**values):
+            self.create(
+                content_type_id=ct_id,
+                object_id=force_text(object_id),
+                deleted_id=deleted_id,
+            )
+
+    def since(self, token, until):
+        """
+        Changes after the given sync token (see Change.sync_token), up to
+        the date until.
+        """
+        changes = self.filter(date__lte=until)
+        if token != '0':
+            date, pk = parse_sync_token(token)
+            changes = changes.filter(
+                models.Q(date__gt=date) | models.Q(date=date, pk__gt=pk)
+            )
+        return changes.order_by('date', 'pk')
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_sync_token(token):
+    # Raises ValueError or OverflowError for invalid tokens
+    timestamp, pk = token.split('.')
+    date = EPOCH + timedelta(microseconds=int(timestamp))
+    if settings.USE_TZ:
+        date = timezone.make_aware(date, timezone.utc)
+    return date, int(pk)
+
+
+def get_generic_foreign_keys(model):
+    fields = getattr(model._meta, 'private_fields', None)
+    if fields is None:
+        fields = model._meta.virtual_fields
+    return [field for field in fields if isinstance(field, GenericForeignKey)]
+
+
+class Change(models.Model):
+    """
+    Latest change to each object of a synced model.  The date (and primary
+    key, for changes with the same date) serve as the sync token for
+    incremental updates.
+    """
+    content_type = models.ForeignKey(DjangoContentType)
+    object_id = models.CharField(max_length=255)
+    deleted_id = models.CharField(max_length=255, null=True, blank=True)
+    date = models.DateTimeField(auto_now=True)
+
+    objects = ChangeManager()
+
+    @property
+    def is_deleted(self):
+        return self.deleted_id is not None
+
+    @property
+    def sync_token(self):
+        date = self.date
+        if timezone.is_aware(date):
+            date = timezone.make_naive(date, timezone.utc)
+        delta = date - EPOCH
+        timestamp = (
+            (delta.days * 86400 + delta.seconds) * 1000000
+            + delta.microseconds
+        )
+        return '%s.%s' % (timestamp, self.pk)
+
+    class Meta:
+        db_table = 'wq_change'
+        index_together = [
+            ('content_type', 'object_id'),
+            ('content_type', 'date'),
+        ]
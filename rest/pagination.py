@@ -1,11 +1,225 @@
+from rest_framework import pagination
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.core.paginator import (
+    Paginator as DjangoPaginator, Page, EmptyPage, PageNotAnInteger,
+    InvalidPage,
+)
+from django.core.cache import caches
+from django.db import connections
+from django.utils.encoding import force_text
+from django.utils.functional import cached_property
 from collections import OrderedDict
 from rest_framework.response import Response
+from math import ceil
+import hashlib
+import json
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
+def estimate_count(queryset):
+    """
+    Return the PostgreSQL planner's row estimate for queryset, or None if
+    no estimate is available.  Unfiltered querysets use pg_class.reltuples;
+    anything else uses the row count from EXPLAIN.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    query = queryset.query
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        if not query.where:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)]
+            )
+            row = cursor.fetchone()
+            # reltuples is -1 (or 0) until the table has been analyzed
+            if row and row[0] > 0:
+                return int(row[0])
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class LookaheadPage(Page):
+    """
+    Page for paginators without an exact count: whether there is a next
+    page is determined by fetching one extra row.
+    """
+    def __init__(self, object_list, number, paginator, has_next):
+        super(LookaheadPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+
+class Paginator(DjangoPaginator):
+    """
+    Django paginator with a configurable count strategy:
+
+    exact: SELECT COUNT(*) on every request (Django default)
+    cached: exact count, cached per query for count_timeout seconds (in
+            the count_cache_alias cache)
+    estimate: planner estimate, falling back to an exact count when the
+              estimate is below count_threshold
+    none: no count at all; "count" and "pages" are reported as unknown
+    """
+    def __init__(self, object_list, per_page, count_mode='exact',
+                 count_timeout=300, count_threshold=100000,
+                 count_cache_alias='default', **kwargs):
+        if count_mode not in COUNT_MODES:
+            raise ValueError("Unknown count mode: %s" % count_mode)
+        self.count_mode = count_mode
+        self.count_timeout = count_timeout
+        self.count_cache_alias = count_cache_alias
+        self.count_threshold = count_threshold
+        self.count_is_exact = True
+        super(Paginator, self).__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_mode == 'none':
+            self.count_is_exact = False
+            return None
+        if self.count_mode == 'estimate':
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.count_threshold:
+                self.count_is_exact = False
+                return estimate
+        if self.count_mode == 'cached':
+            return self.get_cached_count()
+        return self.get_exact_count()
+
+    def get_exact_count(self):
+        try:
+            return self.object_list.count()
+        except (AttributeError, TypeError):
+            return len(self.object_list)
+
+    def get_count_cache_key(self):
+        query = self.object_list.query
+        sql, params = query.sql_with_params()
+        signature = json.dumps([
+            self.object_list.db, sql, [force_text(p) for p in params]
+        ])
+        return 'wq-count:%s:%s' % (
+            self.object_list.model._meta,
+            hashlib.sha1(signature.encode('utf-8')).hexdigest(),
+        )
+
+    def get_cached_count(self):
+        try:
+            key = self.get_count_cache_key()
+        except (AttributeError, EmptyResultSet):
+            return self.get_exact_count()
+        cache = caches[self.count_cache_alias]
+        count = cache.get(key)
+        if count is None:
+            count = self.get_exact_count()
+            cache.set(key, count, self.count_timeout)
+        return count
+
+    @cached_property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        hits = max(1, self.count - self.orphans)
+        return int(ceil(hits / float(self.per_page)))
+
+    def validate_number(self, number):
+        # Evaluate count first, to determine whether it is exact
+        self.count
+        if self.count_is_exact:
+            return super(Paginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super(Paginator, self).page(number)
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            raise EmptyPage('That page contains no results')
+        return LookaheadPage(
+            items[:self.per_page], number, self, len(items) > self.per_page
+        )
 
 
 class Pagination(PageNumberPagination):
     page_size = 50
     page_size_query_param = 'limit'
+    count_mode = 'exact'
+    count_timeout = 300
+    count_threshold = 100000
+    count_cache_alias = 'default'
+
+    def get_django_paginator(self, queryset, page_size):
+        return Paginator(
+            queryset, page_size,
+            count_mode=self.count_mode,
+            count_timeout=self.count_timeout,
+            count_threshold=self.count_threshold,
+            count_cache_alias=self.count_cache_alias,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page(queryset, request)
+        if page is None:
+            return None
+        return list(page)
+
+    def get_page(self, queryset, request):
+        """
+        Paginate queryset without evaluating it (unless the count strategy
+        needs to look ahead), and return the page.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.get_django_paginator(queryset, page_size)
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages or 1
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound('Invalid page "{page_number}": {message}.'.format(
+                page_number=page_number, message=force_text(exc)
+            ))
+
+        self.request = request
+        return self.page
 
     def get_paginated_response(self, data):
         return Response(OrderedDict([
@@ -18,8 +232,64 @@ class Pagination(PageNumberPagination):
             ('page', self.page.number),
             ('pages', self.page.paginator.num_pages),
             ('per_page', self.page.paginator.per_page),
-            ('multiple', self.page.paginator.num_pages > 1),
+            ('multiple', self.page.has_other_pages()),
 
             # Actual data ('results' in DRF)
             ('list', data)
         ]))
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination for large tables, with the same wq.db metadata keys
+    as Pagination.  Since there is no count, the page number is tracked via
+    the next/previous links and "pages" is left empty.
+    """
+    page_size = 50
+    page_size_query_param = 'limit'
+    ordering = '-pk'
+    page_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            self.page_number = max(
+                int(request.query_params.get(self.page_query_param, 1)), 1
+            )
+        except ValueError:
+            self.page_number = 1
+        return super(CursorPagination, self).paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_next_link(self):
+        url = super(CursorPagination, self).get_next_link()
+        if url:
+            url = replace_query_param(
+                url, self.page_query_param, self.page_number + 1
+            )
+        return url
+
+    def get_previous_link(self):
+        url = super(CursorPagination, self).get_previous_link()
+        if url:
+            if self.page_number > 2:
+                url = replace_query_param(
+                    url, self.page_query_param, self.page_number - 1
+                )
+            else:
+                url = remove_query_param(url, self.page_query_param)
+        return url
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+
+            # wq.db additional metadata
+            ('page', self.page_number),
+            ('pages', None),
+            ('per_page', self.page_size),
+            ('multiple', bool(self.has_next or self.has_previous)),
+
+            ('list', data)
+        ]))
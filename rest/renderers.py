@@ -1,16 +1,106 @@
-from rest_framework.renderers import JSONRenderer
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+from rest_framework.utils import encoders
 from django.conf import settings
+from collections import OrderedDict
+from functools import partial
+import json
+import re
+import uuid
 from wq.db.default_settings import SRID as DEFAULT_SRID
+from .topojson import (
+    Topology, DEFAULT_QUANTIZATION, MIN_QUANTIZATION, MAX_QUANTIZATION,
+)
+
+
+class RawJSON(object):
+    """
+    JSON text that has already been rendered (e.g. GeoJSON geometry or list
+    pages from the database), to be inserted into the output as is.
+    """
+    def __init__(self, json):
+        self.json = json
+
+    def with_member(self, key, value):
+        """
+        Return a copy of this (object) fragment with an additional member.
+        """
+        text = self.json.rstrip()
+        if not text.endswith('}'):
+            raise ValueError("Not a JSON object")
+        text = text[:-1].rstrip()
+        member = '%s:%s' % (json.dumps(key), json.dumps(value))
+        if not text.endswith('{'):
+            member = ',' + member
+        return RawJSON(text + member + '}')
+
+    def __repr__(self):
+        return 'RawJSON(%r)' % self.json
+
+
+class RawJSONFragments(object):
+    """
+    Collects RawJSON text while encoding, in place of which the encoder
+    outputs placeholder strings.  Placeholders include a random nonce, so
+    that they cannot be spoofed by (user-provided) string values.
+    """
+    def __init__(self):
+        self.nonce = uuid.uuid4().hex
+        self.texts = []
+
+    def add(self, text):
+        self.texts.append(text)
+        return '__wq_raw_json_%s_%s__' % (self.nonce, len(self.texts) - 1)
+
+    def splice(self, content):
+        """
+        Replace the placeholders in encoded content with the RawJSON
+        fragment text, without parsing either.
+        """
+        if not self.texts:
+            return content
+
+        def replace(match):
+            index = int(match.group(1))
+            if index >= len(self.texts):
+                return match.group(0)
+            return self.texts[index].encode('utf-8')
+
+        pattern = re.compile(
+            ('"__wq_raw_json_%s_([0-9]+)__"' % self.nonce).encode('ascii')
+        )
+        return pattern.sub(replace, content)
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """
+    Encodes RawJSON fragments as placeholders, collecting their text in
+    fragments (see RawJSONFragments).
+    """
+    def __init__(self, *args, **kwargs):
+        self.fragments = kwargs.pop('fragments', None) or RawJSONFragments()
+        super(JSONEncoder, self).__init__(*args, **kwargs)
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            return self.fragments.add(obj.json)
+        return super(JSONEncoder, self).default(obj)
 
 
 class JSONRenderer(JSONRenderer):
+    encoder_class = JSONEncoder
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         if renderer_context and 'request' in renderer_context:
             if not renderer_context['request'].is_ajax():
                 renderer_context['indent'] = 4
-        return super(JSONRenderer, self).render(
+        fragments = RawJSONFragments()
+        self.encoder_class = partial(
+            type(self).encoder_class, fragments=fragments
+        )
+        ret = super(JSONRenderer, self).render(
             data, accepted_media_type, renderer_context
         )
+        return fragments.splice(ret)
 
 
 class GeoJSONRenderer(JSONRenderer):
@@ -18,29 +108,107 @@ class GeoJSONRenderer(JSONRenderer):
     format = 'geojson'
 
     def render(self, data, *args, **kwargs):
+        data, simple = self.to_geojson(data)
+        crs = self.get_crs()
+        if not simple and crs:
+            data['crs'] = crs
+        return super(GeoJSONRenderer, self).render(data, *args, **kwargs)
+
+    def to_geojson(self, data):
+        """
+        Convert list, paginated list, and detail data to a GeoJSON
+        FeatureCollection or Feature.  Returns (data, simple), where simple
+        indicates that some features were built from latitude & longitude.
+        """
         if isinstance(data, list):
             features, simple = self.render_features(data)
             data = {
                 'type': 'FeatureCollection',
                 'features': features
             }
+        elif isinstance(data, RawJSON):
+            # Features rendered by the database
+            data = {
+                'type': 'FeatureCollection',
+                'features': data
+            }
+            simple = False
         elif "list" in data and isinstance(data['list'], list):
             features, simple = self.render_features(data['list'])
             data['type'] = 'FeatureCollection'
             data['features'] = features
             del data['list']
+        elif "list" in data and isinstance(data['list'], RawJSON):
+            data['type'] = 'FeatureCollection'
+            data['features'] = data['list']
+            del data['list']
+            simple = False
 
         else:
             data, simple = self.render_feature(data)
+        return data, simple
 
-        if not simple and getattr(settings, 'SRID', None) != DEFAULT_SRID:
-            data['crs'] = {
-                'type': 'name',
-                'properties': {
-                    'name': 'urn:ogc:def:crs:EPSG::%s' % settings.SRID
-                }
+    def get_crs(self):
+        if getattr(settings, 'SRID', None) == DEFAULT_SRID:
+            return None
+        return {
+            'type': 'name',
+            'properties': {
+                'name': 'urn:ogc:def:crs:EPSG::%s' % settings.SRID
             }
-        return super(GeoJSONRenderer, self).render(data, *args, **kwargs)
+        }
+
+    stream_buffer_size = 65536
+
+    def render_stream(self, data, objs):
+        """
+        Generate an encoded FeatureCollection, rendering each object from
+        the (lazy) iterable objs as it is reached so that the collection is
+        never held in memory.  data contains any other top-level keys (e.g.
+        pagination metadata).
+        """
+        def encode(obj):
+            fragments = RawJSONFragments()
+            content = json.dumps(
+                obj,
+                cls=partial(type(self).encoder_class, fragments=fragments),
+                ensure_ascii=self.ensure_ascii,
+                separators=(',', ':'),
+            ).encode('utf-8')
+            return fragments.splice(content)
+
+        collection = OrderedDict(data)
+        collection['type'] = 'FeatureCollection'
+        collection['features'] = []
+
+        # Everything up to and including the opening bracket of "features"
+        buf = [encode(collection)[:-2]]
+        size = len(buf[0])
+        has_simple = False
+        first = True
+        for obj in objs:
+            feature, simple = self.render_feature(obj)
+            if simple:
+                has_simple = True
+                if feature['geometry']['coordinates'][0] is None:
+                    continue
+            chunk = encode(feature)
+            if not first:
+                chunk = b',' + chunk
+            first = False
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= self.stream_buffer_size:
+                yield b''.join(buf)
+                buf = []
+                size = 0
+
+        buf.append(b']')
+        crs = self.get_crs()
+        if not has_simple and crs:
+            buf.append(b',"crs":' + encode(crs))
+        buf.append(b'}')
+        yield b''.join(buf)
 
     def render_feature(self, obj):
         feature = {
@@ -63,7 +231,9 @@ class GeoJSONRenderer(JSONRenderer):
 
         else:
             for key, val in list(obj.items()):
-                if isinstance(val, dict) and 'type' in val:
+                # Pre-encoded values are GeoJSON geometries (GeometryField)
+                if isinstance(val, RawJSON) or (
+                        isinstance(val, dict) and 'type' in val):
                     feature['geometry'] = val
                     del obj[key]
 
@@ -86,3 +256,81 @@ class GeoJSONRenderer(JSONRenderer):
             else:
                 features.append(feature)
         return features, has_simple
+
+
+class TopoJSONRenderer(GeoJSONRenderer):
+    """
+    Renders the same data as GeoJSONRenderer as a quantized TopoJSON
+    topology, with boundaries shared by adjacent polygons stored once.
+    """
+    media_type = 'application/topo+json'
+    format = 'topojson'
+    quantization = DEFAULT_QUANTIZATION
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        geojson, simple = self.to_geojson(data)
+        if geojson.get('type', None) == 'FeatureCollection':
+            features = geojson.pop('features')
+            if isinstance(features, RawJSON):
+                features = json.loads(features.json)
+        elif 'features' in geojson:
+            # Feature with nested features (e.g. edit view)
+            features = geojson.pop('features')
+            geojson = {'properties': geojson.get('properties', {})}
+        else:
+            features = [geojson]
+            geojson = {}
+        features = [self.parse_feature(feature) for feature in features]
+
+        topology = Topology(
+            features, self.get_quantization(renderer_context)
+        ).to_topojson(self.get_object_name(renderer_context))
+        for key, val in geojson.items():
+            if key not in ('type', 'id', 'geometry'):
+                topology[key] = val
+        crs = self.get_crs()
+        if not simple and crs:
+            topology['crs'] = crs
+        return super(GeoJSONRenderer, self).render(
+            topology, accepted_media_type, renderer_context
+        )
+
+    def parse_feature(self, feature):
+        geometry = feature.get('geometry', None)
+        if isinstance(geometry, RawJSON):
+            feature['geometry'] = json.loads(geometry.json)
+        return feature
+
+    def get_quantization(self, renderer_context):
+        request = renderer_context.get('request', None)
+        if request is None:
+            return self.quantization
+        try:
+            quantization = int(request.GET.get(
+                'quantization', self.quantization
+            ))
+        except ValueError:
+            return self.quantization
+        return min(max(quantization, MIN_QUANTIZATION), MAX_QUANTIZATION)
+
+    def get_object_name(self, renderer_context):
+        view = renderer_context.get('view', None)
+        model = getattr(view, 'model', None)
+        if model is not None:
+            return model._meta.model_name
+        return 'features'
+
+
+class MVTRenderer(BaseRenderer):
+    """
+    Passes through Mapbox Vector Tiles already encoded by PostGIS (see
+    rest.tiles).
+    """
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
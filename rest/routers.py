@@ -1,18 +1,55 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+import uuid
+import warnings
+from collections import OrderedDict
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+except ImportError:
+    # Python 2 without the futures backport; lists will run sequentially
+    ThreadPoolExecutor = None
+
 from django.utils.encoding import force_text
+from django.utils import translation
+from django.http import QueryDict, Http404
+from django.db import (
+    close_old_connections, connections, transaction, DatabaseError,
+    IntegrityError,
+)
+from django.db.models.signals import pre_save, post_save
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.utils.six import string_types
 from django.conf.urls import url
 from django.core.exceptions import ImproperlyConfigured
 
 from django.conf import settings
+from django.apps import apps
 from rest_framework.routers import DefaultRouter, Route
 from rest_framework.urlpatterns import format_suffix_patterns
 from rest_framework.settings import api_settings
 from rest_framework.response import Response
-
-from .model_tools import get_ct
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import clone_request
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.serializers import Serializer, ListSerializer
+from rest_framework.fields import Field
+
+from .model_tools import get_ct, get_object_id
 from .permissions import has_perm
 from .views import SimpleViewSet, ModelViewSet
 from .serializers import ModelSerializer
+from .pagination import CursorPagination
+from .tiles import get_tile_source, get_tile_dependencies
+
+logger = logging.getLogger(__name__)
+
+
+COMPILED_CONFIG_VERSION = 1
 
 
 class ModelRouter(DefaultRouter):
@@ -27,10 +64,44 @@ class ModelRouter(DefaultRouter):
     _page_models = {}
     _url_models = {}
     _extra_config = {}
+    _compiled_serializers = {}
+    _serializer_stats = {'hits': 0, 'misses': 0}
+    _compiled_viewsets = {}
+    _list_views = {}
+    _cache_timeouts = {}
+    _lookups = {}
+    _cache_dependencies = {}
+    _user_configs = {}
+    _config_hashes = {}
 
     include_root_view = False
     include_config_view = True
     include_multi_view = True
+    include_batch_view = True
+
+    # Run /multi.json lists in a thread pool when multi_workers > 1.
+    # multi_timeout is an overall deadline for the request; lists that are
+    # still running when it passes are reported as timed out, but (since
+    # threads cannot be interrupted) finish in the background, so pair it
+    # with a database statement timeout.
+    multi_workers = 1
+    multi_timeout = None
+    _multi_executor = None
+    _multi_lock = threading.Lock()
+
+    # Django cache used for models registered with cache=...
+    cache_alias = 'default'
+
+    # Timeout for cached vector tiles (which are invalidated on change)
+    tile_cache_timeout = 3600
+
+    # Seconds to hold back recent changes from /[url]/changes.json, so
+    # that transactions still open when a sync token is issued are not
+    # skipped
+    sync_lag = 5
+
+    # Maximum number of rows per bulk query in /batch.json
+    batch_size = 500
 
     default_serializer_class = ModelSerializer
 
@@ -48,7 +119,7 @@ class ModelRouter(DefaultRouter):
         super(ModelRouter, self).__init__(trailing_slash=trailing_slash)
 
     def register_model(self, model, viewset=None, serializer=None,
-                       queryset=None, filter=None, **kwargs):
+                       queryset=None, filter=None, cache=None, **kwargs):
         if isinstance(model, string_types) and '.' in model:
             from django.db.models import get_model
             model = get_model(*model.split('.'))
@@ -60,6 +131,8 @@ class ModelRouter(DefaultRouter):
             self.register_queryset(model, queryset)
         if filter:
             self.register_filter(model, filter)
+        if cache:
+            self.register_cache(model, cache)
 
         if 'name' not in kwargs:
             kwargs['name'] = model._meta.model_name
@@ -94,9 +167,13 @@ class ModelRouter(DefaultRouter):
 
     def register_viewset(self, model, viewset):
         self._viewsets[model] = viewset
+        self.reset_viewsets()
 
     def register_serializer(self, model, serializer):
         self._serializers[model] = serializer
+        self.update_lookup(model)
+        self.reset_serializers()
+        self.reset_viewsets()
         self._base_config = None
 
     def register_queryset(self, model, queryset):
@@ -105,14 +182,26 @@ class ModelRouter(DefaultRouter):
     def register_filter(self, model, queryset):
         self._filters[model] = queryset
 
+    def register_cache(self, model, timeout=True):
+        if timeout is True:
+            timeout = DEFAULT_TIMEOUT
+        self._cache_timeouts[model] = timeout
+        self._cache_watch = None
+
     def register_config(self, model, config):
         self._config[model] = config
+        self.update_lookup(model)
+        self.reset_serializers()
+        self.reset_viewsets()
         self._base_config = None
 
     def update_config(self, model, **kwargs):
         if model not in self._config:
             raise RuntimeError("%s must be registered first" % model)
         self._config[model].update(kwargs)
+        self.update_lookup(model)
+        self.reset_serializers()
+        self.reset_viewsets()
         self._base_config = None
 
     def set_extra_config(self, **extra):
@@ -138,6 +227,22 @@ class ModelRouter(DefaultRouter):
                 return default(real_model)
 
     def get_serializer_for_model(self, model_class, serializer_depth=None):
+        # Serializer classes are compiled once per (model, depth) so that DRF
+        # can reuse its per-class field caches across requests
+        key = (model_class, serializer_depth)
+        serializer = self._compiled_serializers.get(key, None)
+        if serializer is not None:
+            self._serializer_stats['hits'] += 1
+            return serializer
+
+        self._serializer_stats['misses'] += 1
+        serializer = self.build_serializer_for_model(
+            model_class, serializer_depth
+        )
+        self._compiled_serializers[key] = serializer
+        return serializer
+
+    def build_serializer_for_model(self, model_class, serializer_depth=None):
         serializer = self.get_class(
             self._serializers, model_class,
             self.get_default_serializer_class
@@ -164,6 +269,16 @@ class ModelRouter(DefaultRouter):
 
         return serializer
 
+    def reset_serializers(self):
+        self._compiled_serializers.clear()
+        self._cache_dependencies.clear()
+        self._cache_watch = None
+
+    def serializer_cache_info(self):
+        info = dict(self._serializer_stats)
+        info['size'] = len(self._compiled_serializers)
+        return info
+
     def serialize(self, obj, many=False, depth=None):
         if many:
             # assume obj is a queryset
@@ -171,7 +286,7 @@ class ModelRouter(DefaultRouter):
             if depth is None:
                 depth = 0
         else:
-            model = obj
+            model = type(obj)
             if depth is None:
                 depth = 1
         serializer = self.get_serializer_for_model(model, depth)
@@ -185,14 +300,13 @@ class ModelRouter(DefaultRouter):
         return api_settings.PAGE_SIZE
 
     def paginate(self, model, page_num, request):
-        # FIXME: should copy() before modifying but doing so causes recursion
-        request.GET = {
-            'page': page_num,
-        }
-        view = self.get_viewset_for_model(model).as_view(
-            actions={'get': 'list'},
-        )
-        return view(request).data
+        # Run the list view against a copy of the underlying HttpRequest, so
+        # the caller's query parameters are left intact
+        list_request = copy.copy(getattr(request, '_request', request))
+        list_request.GET = QueryDict(mutable=True)
+        list_request.GET['page'] = page_num
+        view = self.get_list_view_for_model(model)
+        return view(list_request).data
 
     def get_queryset_for_model(self, model, request=None):
         if model in self._querysets:
@@ -203,22 +317,207 @@ class ModelRouter(DefaultRouter):
             qs = self._filters[model](qs, request)
         return qs
 
+    def get_cache_dependencies(self, model):
+        """
+        Determine which models appear in the output for the given model:
+        the model itself, its foreign key parents, and any nested
+        serializers (e.g. attachments) and their foreign key parents.
+        """
+        if model in self._cache_dependencies:
+            return self._cache_dependencies[model]
+
+        def parents(model):
+            return [
+                pct.model_class()
+                for pct in get_ct(model).get_foreign_keys()
+            ]
+
+        models = set([model])
+        models.update(parents(model))
+        serializer = self.get_serializer_for_model(model, 1)
+        for field in serializer(context={'router': self}).fields.values():
+            if isinstance(field, ListSerializer):
+                field = field.child
+            nested_model = getattr(getattr(field, 'Meta', None), 'model', None)
+            if isinstance(field, Serializer) and nested_model:
+                models.add(nested_model)
+                models.update(parents(nested_model))
+
+        dependencies = set(
+            dep._meta.concrete_model for dep in models if dep is not None
+        )
+        self._cache_dependencies[model] = dependencies
+        return dependencies
+
+    _cache_watch = None
+
+    def get_cache_watch(self):
+        if self._cache_watch is None:
+            watch = set()
+            for model in self._cache_timeouts:
+                watch.update(self.get_cache_dependencies(model))
+            for model in self._models:
+                if self.model_is_mapped(model):
+                    watch.update(get_tile_dependencies(model))
+            self._cache_watch = watch
+        return self._cache_watch
+
+    def get_cache_version_key(self, model):
+        return 'wq-cache-version:%s' % model._meta
+
+    def invalidate_cache(self, model):
+        if model._meta.apps is not apps:
+            # Historical model (i.e. in a migration)
+            return
+        model = model._meta.concrete_model
+        if model not in self.get_cache_watch():
+            return
+        caches[self.cache_alias].set(
+            self.get_cache_version_key(model), uuid.uuid4().hex, None
+        )
+
+    def get_cache_timeout(self, model):
+        return self._cache_timeouts.get(
+            model, self._cache_timeouts.get(model._meta.concrete_model)
+        )
+
+    def get_cache_versions(self, models):
+        # Each model in the output has a version token that is replaced
+        # whenever an instance is saved or deleted
+        cache = caches[self.cache_alias]
+        keys = sorted(self.get_cache_version_key(model) for model in models)
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                versions[key] = uuid.uuid4().hex
+                cache.set(key, versions[key], None)
+        return [versions[key] for key in keys]
+
+    def get_request_cache_key(self, prefix, model, request, versions,
+                              params=None):
+        user = request.user
+        if user.is_authenticated():
+            perms = self.get_permission_fingerprint(user)
+            if model in self._filters:
+                # Custom filters may depend on the user
+                perms += '-%s' % user.pk
+        else:
+            perms = 'anonymous'
+
+        parts = [
+            # Paginated responses contain absolute next/previous links
+            request.build_absolute_uri(request.path),
+            sorted(request.GET.lists()) if params is None else params,
+            request.accepted_renderer.format,
+            translation.get_language(),
+            perms,
+            versions,
+        ]
+        text = json.dumps(parts, default=force_text)
+        return prefix + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_response_cache_key(self, model, request):
+        if self.get_cache_timeout(model) is None:
+            return None
+        versions = self.get_cache_versions(self.get_cache_dependencies(model))
+        return self.get_request_cache_key(
+            'wq-response:', model, request, versions
+        )
+
+    def get_cached_response(self, model, request):
+        key = self.get_response_cache_key(model, request)
+        if key is None:
+            return None
+        return caches[self.cache_alias].get(key)
+
+    def set_cached_response(self, model, request, data):
+        key = self.get_response_cache_key(model, request)
+        if key is None:
+            return
+        caches[self.cache_alias].set(
+            key, data, self.get_cache_timeout(model)
+        )
+
+    def get_tile_cache_key(self, model, request, params=None):
+        versions = self.get_cache_versions(get_tile_dependencies(model))
+        return self.get_request_cache_key(
+            'wq-tile:', model, request, versions, params
+        )
+
+    def get_cached_tile(self, model, request, params=None):
+        key = self.get_tile_cache_key(model, request, params)
+        return caches[self.cache_alias].get(key)
+
+    def set_cached_tile(self, model, request, tile, params=None):
+        key = self.get_tile_cache_key(model, request, params)
+        caches[self.cache_alias].set(key, tile, self.tile_cache_timeout)
+
+    def update_lookup(self, model):
+        # Precompute lookup field for get_object_id() & get_by_identifier()
+        lookup = self._config.get(model, {}).get('lookup', None)
+        if lookup is None:
+            meta = getattr(self._serializers.get(model, None), 'Meta', None)
+            lookup = getattr(meta, 'wq_config', {}).get('lookup', None)
+        self._lookups[model] = lookup or 'pk'
+
     def get_lookup_for_model(self, model_class):
-        config = self.get_model_config(model_class) or {}
-        return config.get('lookup', 'pk')
+        if model_class not in self._lookups:
+            model_class = model_class._meta.concrete_model
+        return self._lookups.get(model_class, 'pk')
 
     def get_viewset_for_model(self, model_class):
-        viewset = self.get_class(
-            self._viewsets, model_class, lambda d: ModelViewSet
-        )
-        lookup = self.get_lookup_for_model(model_class)
+        # Viewset classes are built once per model and reused for each request
+        viewset = self._compiled_viewsets.get(model_class, None)
+        if viewset is None:
+            viewset = self.build_viewset_for_model(model_class)
+            self._compiled_viewsets[model_class] = viewset
+        return viewset
+
+    def get_list_view_for_model(self, model_class):
+        view = self._list_views.get(model_class, None)
+        if view is None:
+            view = self.get_viewset_for_model(model_class).as_view(
+                actions={'get': 'list'},
+            )
+            self._list_views[model_class] = view
+        return view
 
+    def reset_viewsets(self):
+        self._compiled_viewsets.clear()
+        self._list_views.clear()
+
+    def get_pagination_class_for_model(self, model_class):
+        config = self.get_model_config(model_class) or {}
         per_page = self.get_paginate_by_for_model(model_class)
-        if per_page != api_settings.PAGE_SIZE:
+        if config.get('pagination', None) == 'cursor':
+            cursor_ordering = config.get('ordering', '-pk')
+
+            class CustomPagination(CursorPagination):
+                page_size = per_page
+                ordering = cursor_ordering
+        elif per_page != api_settings.PAGE_SIZE or 'count' in config:
             class CustomPagination(api_settings.DEFAULT_PAGINATION_CLASS):
                 page_size = per_page
+                count_mode = config.get('count', 'exact')
+                count_cache_alias = self.cache_alias
+
+            for key in ('count_timeout', 'count_threshold'):
+                if key in config:
+                    setattr(CustomPagination, key, config[key])
         else:
             CustomPagination = None
+        return CustomPagination
+
+    def build_viewset_for_model(self, model_class):
+        viewset = self.get_class(
+            self._viewsets, model_class, lambda d: ModelViewSet
+        )
+        lookup = self.get_lookup_for_model(model_class)
+
+        CustomPagination = self.get_pagination_class_for_model(model_class)
+        config = self.get_model_config(model_class) or {}
+        render_in_db = config.get('db_render', False)
+        stream = config.get('stream_geojson', False)
 
         class ViewSet(viewset):
             model = model_class
@@ -227,6 +526,10 @@ class ModelRouter(DefaultRouter):
 
             if CustomPagination:
                 pagination_class = CustomPagination
+            if render_in_db:
+                db_render = True
+            if stream:
+                stream_geojson = True
 
         return ViewSet
 
@@ -237,6 +540,12 @@ class ModelRouter(DefaultRouter):
         if self._base_config:
             return self._base_config
 
+        compiled = self.get_compiled_config()
+        if compiled:
+            self.reset_user_configs()
+            self._base_config = compiled
+            return self._base_config
+
         from django.contrib.auth.models import AnonymousUser
         user = AnonymousUser()
         pages = {}
@@ -269,18 +578,168 @@ class ModelRouter(DefaultRouter):
 
             pages[info['name']] = info
 
+        self.reset_user_configs()
         self._base_config = {'pages': pages}
         self._base_config.update(self._extra_config)
         return self._base_config
 
+    _compiled_config = None
+
+    def get_config_fingerprint(self):
+        """
+        Summarize everything registered with the router that affects
+        base_config (including the field definitions of each registered
+        model and the declared fields and Meta of each serializer), for
+        validating precompiled configs.
+        """
+        def class_path(cls):
+            return '%s.%s' % (cls.__module__, cls.__name__)
+
+        def describe(value):
+            # Stable representation of deconstruct() arguments (e.g. avoid
+            # memory addresses in the repr of defaults and validators)
+            if isinstance(value, Field):
+                return describe_field(value)
+            if hasattr(value, 'deconstruct') and not isinstance(value, type):
+                return list(value.deconstruct())
+            if hasattr(value, '__module__') and hasattr(value, '__name__'):
+                return class_path(value)
+            return force_text(value)
+
+        def describe_field(field):
+            # Serializer fields record their constructor arguments
+            info = [
+                class_path(type(field)),
+                list(getattr(field, '_args', [])),
+                getattr(field, '_kwargs', {}),
+            ]
+            if hasattr(field, '_declared_fields'):
+                info.append(serializer_fields(type(field)))
+            return info
+
+        def serializer_fields(serializer):
+            meta = getattr(serializer, 'Meta', None)
+            return {
+                'declared': [
+                    [name, field] for name, field
+                    in serializer._declared_fields.items()
+                ],
+                'meta': {
+                    name: getattr(meta, name) for name in dir(meta)
+                    if not name.startswith('_')
+                },
+            }
+
+        def model_fields(model):
+            return [
+                list(field.deconstruct()) for field
+                in model._meta.fields + model._meta.many_to_many
+            ]
+
+        registry = {
+            'config': sorted(
+                [str(model._meta), conf]
+                for model, conf in self._config.items()
+            ),
+            'models': sorted(str(model._meta) for model in self._models),
+            'fields': sorted(
+                [str(model._meta), model_fields(model)]
+                for model in self._models
+            ),
+            'serializers': sorted(
+                [
+                    str(model._meta), class_path(serializer),
+                    serializer_fields(serializer),
+                ]
+                for model, serializer in self._serializers.items()
+            ),
+            'pages': sorted(
+                [name, conf] for name, (conf, view)
+                in self._extra_pages.items()
+            ),
+            'extra': self._extra_config,
+            'anonymous_permissions': sorted(
+                getattr(settings, 'ANONYMOUS_PERMISSIONS', [])
+            ),
+            'version': self.version,
+        }
+        text = json.dumps(registry, sort_keys=True, default=describe)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_compiled_config_data(self):
+        return {
+            'version': COMPILED_CONFIG_VERSION,
+            'fingerprint': self.get_config_fingerprint(),
+            'config': self.base_config,
+        }
+
+    def load_compiled_config(self, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        if data.get('version', None) != COMPILED_CONFIG_VERSION:
+            warnings.warn(
+                "Ignoring %s: unsupported compiled config version" % filename
+            )
+            return
+        self._compiled_config = data
+        self._base_config = None
+
+    def get_compiled_config(self):
+        if not self._compiled_config:
+            return None
+        if self._compiled_config['fingerprint'] != (
+                self.get_config_fingerprint()):
+            # Registrations have changed since the config was compiled
+            warnings.warn(
+                "Precompiled config is out of date; regenerate it with "
+                "./manage.py dump_config --format compiled"
+            )
+            self._compiled_config = None
+            return None
+        return self._compiled_config['config']
+
     def get_config(self, user=None):
         if user is None or not user.is_authenticated():
             return self.base_config
 
+        # Users with the same effective permissions share a single config
+        base_config = self.base_config
+        key = self.get_permission_fingerprint(user)
+        config = self._user_configs.get(key, None)
+        if config is None:
+            config = self.build_user_config(user, base_config)
+            self._user_configs[key] = config
+        return config
+
+    def get_permission_fingerprint(self, user):
+        if user.is_active and user.is_superuser:
+            perms = ['*']
+        else:
+            perms = sorted(user.get_all_permissions())
+        return hashlib.sha1('\n'.join(perms).encode('utf-8')).hexdigest()
+
+    def reset_user_configs(self):
+        self._user_configs.clear()
+        self._config_hashes.clear()
+
+    def get_config_hash(self, user=None):
+        config = self.get_config(user)
+        if user is None or not user.is_authenticated():
+            key = None
+        else:
+            key = self.get_permission_fingerprint(user)
+        config_hash = self._config_hashes.get(key, None)
+        if config_hash is None:
+            text = json.dumps(config, sort_keys=True, cls=JSONEncoder)
+            config_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            self._config_hashes[key] = config_hash
+        return config_hash
+
+    def build_user_config(self, user, base_config):
         # Add user-specific permissions to configuration
         config = {
             key: val.copy() if hasattr(val, 'copy') else val
-            for key, val in self.base_config.items()
+            for key, val in base_config.items()
         }
         for page, info in config['pages'].items():
             if not info.get('list', False):
@@ -331,10 +790,30 @@ class ModelRouter(DefaultRouter):
     def model_is_registered(self, model):
         return model in self._models
 
+    def model_is_synced(self, model):
+        if model not in self._models:
+            model = model._meta.concrete_model
+            if model not in self._models:
+                return False
+        return bool(self._config[model].get('sync', False))
+
+    def model_is_mapped(self, model):
+        if model not in self._models:
+            return False
+        mapped = self._config[model].get('map', None)
+        if mapped is None:
+            meta = getattr(self._serializers.get(model, None), 'Meta', None)
+            mapped = getattr(meta, 'wq_config', {}).get('map', None)
+        return bool(mapped) and get_tile_source(model) is not None
+
     def get_config_view(self):
         class ConfigView(SimpleViewSet):
             def list(this, request, *args, **kwargs):
-                return Response(self.get_config(request.user))
+                return this.etag_response(
+                    request,
+                    self.get_config(request.user),
+                    self.get_config_hash(request.user),
+                )
         return ConfigView
 
     def get_index(self, user):
@@ -352,7 +831,11 @@ class ModelRouter(DefaultRouter):
     def get_index_view(self):
         class IndexView(SimpleViewSet):
             def list(this, request, *args, **kwargs):
-                return Response(self.get_index(request.user))
+                return this.etag_response(
+                    request,
+                    self.get_index(request.user),
+                    self.get_config_hash(request.user) + '-index',
+                )
         return IndexView
 
     def get_multi_view(self):
@@ -363,21 +846,300 @@ class ModelRouter(DefaultRouter):
         return MultipleListView
 
     def get_multi(self, request, urls):
-        conf = self.get_config(request.user)
         conf_by_url = {
             conf['url']: (page, conf)
             for page, conf
             in self.get_config(request.user)['pages'].items()
         }
-        result = {}
+        models = OrderedDict()
         for listurl in urls:
             if listurl not in conf_by_url:
                 continue
             page, conf = conf_by_url[listurl]
-            model = self._page_models[page]
-            result[listurl] = self.paginate(model, 1, request)
+            if page not in self._page_models:
+                continue
+            models[listurl] = self._page_models[page]
+
+        if self.multi_workers > 1 and ThreadPoolExecutor and len(models) > 1:
+            result = self.get_multi_concurrent(request, models)
+        else:
+            result = {
+                listurl: self.get_multi_list(model, request)
+                for listurl, model in models.items()
+            }
         return Response(result)
 
+    def get_multi_list(self, model, request):
+        # Report errors per list (without exposing exception details) so
+        # one failing list does not prevent the others from loading
+        try:
+            return self.paginate(model, 1, request)
+        except Exception:
+            logger.exception("Error loading %s list", model.__name__)
+            return {'error': 'Could not load list'}
+
+    def get_multi_executor(self):
+        if self._multi_executor is None:
+            with self._multi_lock:
+                if self._multi_executor is None:
+                    self._multi_executor = ThreadPoolExecutor(
+                        self.multi_workers
+                    )
+        return self._multi_executor
+
+    def get_multi_concurrent(self, request, models):
+        language = translation.get_language()
+
+        def get_list(model):
+            # Each worker thread uses its own database connection
+            try:
+                with translation.override(language):
+                    return self.get_multi_list(model, request)
+            finally:
+                close_old_connections()
+
+        executor = self.get_multi_executor()
+        futures = OrderedDict(
+            (listurl, executor.submit(get_list, model))
+            for listurl, model in models.items()
+        )
+        done, pending = wait_futures(
+            futures.values(), timeout=self.multi_timeout
+        )
+        result = {}
+        for listurl, future in futures.items():
+            if future in done:
+                result[listurl] = future.result()
+            else:
+                # Only stops lists that have not started yet
+                future.cancel()
+                result[listurl] = {'error': 'Timed out'}
+        return result
+
+    def get_batch_view(self):
+        class BatchView(SimpleViewSet):
+            def create(this, request, *args, **kwargs):
+                return self.batch(request, request.data)
+        return BatchView
+
+    def batch(self, request, operations):
+        """
+        Validate and save a list of create/update operations, e.g.
+        [{"model": "items", "action": "create", "data": {...}}, ...].
+        Nothing is saved unless every operation is valid.
+        """
+        if not isinstance(operations, list):
+            raise ValidationError("Expected a list of operations")
+
+        results = []
+        valid = []
+        for operation in operations:
+            result, serializer = self.validate_operation(request, operation)
+            results.append(result)
+            if serializer is not None:
+                valid.append((result, serializer))
+
+        if len(valid) < len(operations):
+            return Response(
+                {'success': False, 'results': results},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        saved = True
+        with transaction.atomic():
+            group = []
+            for result, serializer in valid:
+                if group and (
+                        len(group) >= self.batch_size or
+                        not self.same_operation(group[0][1], serializer)):
+                    saved = self.save_operations(group) and saved
+                    group = []
+                group.append((result, serializer))
+            if group:
+                saved = self.save_operations(group) and saved
+            if not saved:
+                transaction.set_rollback(True)
+
+        if not saved:
+            return Response(
+                {'success': False, 'results': results},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        for result, serializer in valid:
+            result['id'] = get_object_id(serializer.instance)
+            result['data'] = serializer.data
+        return Response({'success': True, 'results': results})
+
+    def validate_operation(self, request, operation):
+        result = OrderedDict()
+        if not isinstance(operation, dict):
+            result['status'] = status.HTTP_400_BAD_REQUEST
+            result['errors'] = {'detail': "Expected an object"}
+            return result, None
+
+        for key in ('model', 'action', 'id', 'local_id'):
+            if key in operation:
+                result[key] = operation[key]
+
+        name = operation.get('model', None)
+        model = self._url_models.get(name, self._page_models.get(name))
+        if 'id' in operation:
+            action = operation.get('action', 'update')
+        else:
+            action = operation.get('action', 'create')
+        if model is None or action not in ('create', 'update'):
+            result['status'] = status.HTTP_400_BAD_REQUEST
+            result['errors'] = {'detail': "Unknown model or action"}
+            return result, None
+
+        perm = 'add' if action == 'create' else 'change'
+        if not has_perm(request.user, get_ct(model), perm):
+            result['status'] = status.HTTP_403_FORBIDDEN
+            result['errors'] = {'detail': "Permission denied"}
+            return result, None
+
+        # Use the same viewset, permissions and serializer as the regular
+        # endpoints (with the method of the equivalent regular request)
+        partial = bool(operation.get('partial', False))
+        if action == 'create':
+            method = 'POST'
+        else:
+            method = 'PATCH' if partial else 'PUT'
+        request = clone_request(request, method)
+        viewset = self.get_viewset_for_model(model)(
+            request=request, args=(), kwargs={}, format_kwarg=None,
+            action=action,
+        )
+        instance = None
+        try:
+            viewset.check_permissions(request)
+            viewset.check_throttles(request)
+            if action == 'update':
+                viewset.kwargs = {viewset.lookup_field: operation.get('id')}
+                instance = viewset.get_object()
+        except Http404:
+            result['status'] = status.HTTP_404_NOT_FOUND
+            result['errors'] = {'detail': "Not found"}
+            return result, None
+        except APIException as e:
+            result['status'] = e.status_code
+            result['errors'] = {'detail': e.detail}
+            return result, None
+
+        serializer = viewset.get_serializer(
+            instance,
+            data=operation.get('data', {}),
+            partial=partial,
+        )
+        if not serializer.is_valid():
+            result['status'] = status.HTTP_400_BAD_REQUEST
+            result['errors'] = serializer.errors
+            return result, None
+
+        if action == 'create':
+            result['status'] = status.HTTP_201_CREATED
+        else:
+            result['status'] = status.HTTP_200_OK
+        return result, serializer
+
+    def same_operation(self, serializer1, serializer2):
+        return (
+            type(serializer1) is type(serializer2) and
+            (serializer1.instance is None) == (serializer2.instance is None)
+        )
+
+    def save_operations(self, operations):
+        """
+        Save a group of operations for the same model and action, with a
+        single bulk_create() where possible.  Returns False (after recording
+        the errors in each result) if any operation could not be saved.
+        """
+        created = operations[0][1].instance is None
+        try:
+            with transaction.atomic():
+                self.save_group(operations)
+            return True
+        except DatabaseError:
+            pass
+
+        # Save operations one at a time to find which ones failed
+        saved = True
+        for result, serializer in operations:
+            if created:
+                # Discard any instance from the rolled back attempt
+                serializer.instance = None
+            try:
+                with transaction.atomic():
+                    self.save_group([(result, serializer)])
+            except IntegrityError:
+                logger.exception("Error saving batch operation")
+                result['status'] = status.HTTP_400_BAD_REQUEST
+                result['errors'] = {
+                    'detail': "Could not save (conflicts with existing data)"
+                }
+                saved = False
+            except DatabaseError:
+                logger.exception("Error saving batch operation")
+                result['status'] = status.HTTP_400_BAD_REQUEST
+                result['errors'] = {'detail': "Could not save"}
+                saved = False
+        return saved
+
+    def save_group(self, operations):
+        serializers = [serializer for result, serializer in operations]
+        viewset = serializers[0].context['view']
+        model = serializers[0].Meta.model
+        manager = model._default_manager
+        created = serializers[0].instance is None
+
+        # Only creates are written in bulk (bulk_update() is not available
+        # before Django 2.2), and only if the viewset has the default hook
+        features = connections[manager.db].features
+        can_bulk = (
+            created and len(serializers) > 1 and
+            getattr(features, 'can_return_ids_from_bulk_insert', False) and
+            not self.has_custom_method(viewset, ModelViewSet, 'perform_create')
+        )
+
+        instances = []
+        if can_bulk:
+            for serializer in serializers:
+                instance = serializer.build_instance(serializer.validated_data)
+                if instance is None:
+                    can_bulk = False
+                    break
+                instances.append(instance)
+
+        if can_bulk:
+            using = manager.db
+            for instance in instances:
+                pre_save.send(
+                    sender=model, instance=instance, raw=False, using=using,
+                    update_fields=None,
+                )
+            manager.bulk_create(instances, batch_size=self.batch_size)
+            for serializer, instance in zip(serializers, instances):
+                serializer.instance = instance
+                post_save.send(
+                    sender=model, instance=instance, created=True,
+                    raw=False, using=using, update_fields=None,
+                )
+        else:
+            for serializer in serializers:
+                # Use the same hooks as the regular endpoints
+                if created:
+                    serializer.context['view'].perform_create(serializer)
+                else:
+                    serializer.context['view'].perform_update(serializer)
+
+    def has_custom_method(self, obj, base, name):
+        method = getattr(type(obj), name)
+        default = getattr(base, name)
+        return getattr(method, '__func__', method) is not getattr(
+            default, '__func__', default
+        )
+
     def get_urls(self):
         # Register viewsets with DefaultRouter just before returning urls
 
@@ -409,6 +1171,10 @@ class ModelRouter(DefaultRouter):
             # /multi.json
             self.register('multi', self.get_multi_view(), 'multi')
 
+        if self.include_batch_view:
+            # /batch.json
+            self.register('batch', self.get_batch_view(), 'batch')
+
         if not root:
             # default index
             self.register('', self.get_index_view(), 'index')
@@ -454,6 +1220,27 @@ class ModelRouter(DefaultRouter):
         # Re-register list view, with an additional keyword to filter this
         # model by parent models (e.g. foreign keys)
 
+        # /[model_url]/changes (must precede detail route)
+        if self.model_is_synced(model):
+            routes.insert(0, Route(
+                url=r'^{prefix}/changes{trailing_slash}$',
+                mapping={'get': 'changes'},
+                name='{basename}-changes',
+                initkwargs={'suffix': 'Changes'},
+            ))
+
+        # /[model_url]/tiles/[z]/[x]/[y].mvt (must precede detail route)
+        if self.model_is_mapped(model):
+            routes.insert(0, Route(
+                url=(
+                    r'^{prefix}/tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)'
+                    r'/(?P<y>[0-9]+)\.mvt$'
+                ),
+                mapping={'get': 'tiles'},
+                name='{basename}-tiles',
+                initkwargs={'suffix': 'Tiles'},
+            ))
+
         # /[parentmodel_url]/[foreignkey_value]/[model_url]
         try:
             ct = get_ct(model)
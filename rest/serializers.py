@@ -1,25 +1,104 @@
 from rest_framework import serializers
 from django.contrib.gis.db import models as model_fields
 from django.contrib.gis.geos import GEOSGeometry
+from django.db.models import Prefetch, F, Func, Value
+from collections import OrderedDict
+from django.db.models.fields import FieldDoesNotExist
 from django.utils import timezone
+from django.utils.encoding import force_text
+import json
+import math
 
 from django.conf import settings
 
 from .model_tools import get_object_id, get_by_identifier
+from .renderers import RawJSON
 
 from rest_framework.utils import model_meta
 from html_json_forms.serializers import JSONFormSerializer
 
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+try:
+    from django.contrib.gis.db.models.functions import AsGeoJSON
+except ImportError:
+    # Django < 1.9
+    AsGeoJSON = None
+
+
+GEOJSON_ANNOTATION = '%s_wq_geojson'
+MIN_ZOOM = 0
+MAX_ZOOM = 30
+
+
+class SimplifyPreserveTopology(Func):
+    function = 'ST_SimplifyPreserveTopology'
+
+
+def get_zoom_tolerance(zoom, srid=None):
+    """
+    Return the size of one pixel of a 256px web map tile at the given zoom
+    level, in the units of srid (degrees for geographic coordinates, or
+    the linear units of projected coordinates, e.g. meters or feet).
+    Raises ValueError if zoom is out of range or the units of srid cannot
+    be determined.
+    """
+    if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise ValueError(
+            "Zoom must be between %s and %s" % (MIN_ZOOM, MAX_ZOOM)
+        )
+    if srid is None:
+        srid = getattr(settings, 'SRID', 4326)
+    pixels = 256 * 2 ** zoom
+    if srid in (3857, 900913):
+        return 2 * math.pi * 6378137 / pixels
+    if srid == 4326:
+        return 360.0 / pixels
+
+    try:
+        from django.contrib.gis.gdal import SpatialReference
+        srs = SpatialReference(srid)
+        geographic, projected = srs.geographic, srs.projected
+    except Exception:
+        # GDAL not installed or SRID not known
+        raise ValueError("Unsupported SRID: %s" % srid)
+    if geographic:
+        return 360.0 / pixels
+    if projected and srs.linear_units:
+        # Meters at the equator, converted to the projection's units
+        return 2 * math.pi * 6378137 / pixels / srs.linear_units
+    raise ValueError("Unsupported SRID: %s" % srid)
+
 
 class GeometryField(serializers.Field):
+    def get_attribute(self, instance):
+        # Use GeoJSON text from the database if it was annotated (see
+        # ModelSerializer.get_query_annotations())
+        if len(self.source_attrs) == 1:
+            geojson = getattr(
+                instance, GEOJSON_ANNOTATION % self.source_attrs[0], None
+            )
+            if geojson is not None:
+                return RawJSON(geojson)
+        return super(GeometryField, self).get_attribute(instance)
+
     def to_representation(self, value):
         if value is None:
             return None
-        import json
+        if self.context.get('raw_json', False):
+            # Pre-encoded, to be spliced into the output by the renderer
+            if isinstance(value, RawJSON):
+                return value
+            return RawJSON(value.geojson)
+        if isinstance(value, RawJSON):
+            return json.loads(value.json)
         return json.loads(value.geojson)
 
     def to_internal_value(self, value):
-        import json
         if isinstance(value, dict):
             value = json.dumps(value)
         geom = GEOSGeometry(value)
@@ -60,6 +139,287 @@ class LocalDateTimeField(serializers.ReadOnlyField):
         return value.strftime('%Y-%m-%d %I:%M %p')
 
 
+class CompiledListSerializer(object):
+    """
+    List-mode fast path compiled from a ModelSerializer's fields.  Rows are
+    read with .values() and turned into dicts directly, rather than building
+    model instances and calling each DRF field per row.  Foreign key labels
+    are resolved with one in_bulk() query per relation.
+    """
+    def __init__(self, model, lookups, fields, related, instance_fields,
+                 geometry_options=None):
+        self.model = model
+        self.lookups = lookups
+        self.fields = fields
+        self.related = related
+        self.instance_fields = instance_fields
+        self.geometry_options = geometry_options or {}
+
+    def get_queryset(self, queryset):
+        return queryset.select_related(None).prefetch_related(None).values(
+            *self.lookups
+        )
+
+    def get_related_objects(self, rows):
+        related_objects = {}
+        for name, model_field in self.related.items():
+            ids = set(row[name] for row in rows if row[name] is not None)
+            manager = model_field.rel.to._base_manager
+            related_objects[name] = manager.in_bulk(ids) if ids else {}
+        return related_objects
+
+    def get_instance(self, row, db, related_objects):
+        instance = self.model.from_db(db, [
+            field.attname for field in self.instance_fields
+        ], [
+            row[field.name] for field in self.instance_fields
+        ])
+        for name, objects in related_objects.items():
+            obj = objects.get(row[name], None)
+            model_field = self.related[name]
+            if hasattr(model_field, 'set_cached_value'):
+                model_field.set_cached_value(instance, obj)
+            else:
+                setattr(instance, model_field.get_cache_name(), obj)
+        return instance
+
+    # Model fields whose values come out of PostgreSQL's JSON functions the
+    # same way DRF's JSONRenderer would encode them.
+    json_internal_types = (
+        'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+        'SmallIntegerField', 'PositiveIntegerField',
+        'PositiveSmallIntegerField', 'BooleanField', 'NullBooleanField',
+        'CharField', 'TextField', 'SlugField', 'EmailField', 'URLField',
+        'FloatField', 'ForeignKey', 'OneToOneField',
+    )
+    json_field_types = (
+        serializers.IntegerField,
+        serializers.BooleanField,
+        serializers.NullBooleanField,
+        serializers.FloatField,
+        serializers.ChoiceField,
+    )
+
+    @property
+    def has_geometry(self):
+        return any(field[1] == 'geometry' for field in self.fields)
+
+    # The first field that prevented get_json_expressions() from rendering
+    # in SQL (if any), for reporting
+    json_unsupported = None
+
+    def get_json_expressions(self, geojson=False):
+        """
+        Return the SQL expression (and params) for each output field when
+        rendering rows with PostgreSQL's JSON functions, or None if any
+        field can only be rendered in Python.
+        """
+        self.json_unsupported = None
+        expressions = self.build_json_expressions(geojson)
+        if expressions is None and self.json_unsupported is None:
+            self.json_unsupported = "its fields"
+        return expressions
+
+    def build_json_expressions(self, geojson):
+        # PostgreSQL functions are limited to 100 arguments
+        if len(self.fields) > 50:
+            return None
+        if geojson:
+            names = set(field[0] for field in self.fields)
+            if 'features' in names or (
+                    'latitude' in names and 'longitude' in names):
+                return None
+        expressions = []
+        for name, kind, key, field, model_field in self.fields:
+            # Report this field if it causes a return below
+            self.json_unsupported = "the '%s' field" % name
+            if kind in ('value', 'display'):
+                column = key[0] if kind == 'display' else key
+                if model_field.get_internal_type() not in (
+                        self.json_internal_types):
+                    return None
+            elif kind == 'geometry':
+                column = key
+                if geojson and model_field.null:
+                    # The GeoJSON renderer keeps null geometries as properties
+                    return None
+            else:
+                return None
+            column = 'wq_rows.c%s' % self.lookups.index(column)
+            params = []
+
+            if kind == 'display':
+                sql = 'CASE %s' % column
+                for value, label in key[1].items():
+                    sql += ' WHEN %s THEN %s'
+                    params += [value, force_text(label)]
+                sql += ' ELSE %s::text END' % column
+                if field is not None and not isinstance(
+                        field, serializers.CharField):
+                    return None
+            elif kind == 'geometry':
+                sql = column
+                tolerance = self.geometry_options.get('tolerance', None)
+                if tolerance:
+                    sql = 'ST_SimplifyPreserveTopology(%s, %%s)' % sql
+                    params.append(tolerance)
+                sql = 'ST_AsGeoJSON(%s, %s, 0)::json' % (
+                    sql, int(self.geometry_options.get('precision', 15))
+                )
+            elif field is None or isinstance(field, self.json_field_types):
+                sql = column
+            elif isinstance(field, serializers.CharField):
+                sql = '%s::text' % column
+            else:
+                return None
+            expressions.append((name, kind, sql, params))
+        self.json_unsupported = None
+        return expressions
+
+    def get_json_sql(self, queryset, geojson=False):
+        """
+        Return SQL and params for a query that renders queryset (as
+        returned by get_queryset()) to a JSON array in the database.
+        Returns None if the fields cannot be rendered in SQL.
+        """
+        expressions = self.get_json_expressions(geojson)
+        if expressions is None:
+            return None
+
+        def build_object(items):
+            sql = []
+            params = []
+            for name, expr_sql, expr_params in items:
+                sql.append('%s, ' + expr_sql)
+                params += [name] + expr_params
+            return 'json_build_object(%s)' % ', '.join(sql), params
+
+        if geojson:
+            feature = [('type', '%s', ['Feature'])]
+            properties = []
+            geometry = None
+            for name, kind, sql, params in expressions:
+                if name == 'id':
+                    feature.append((name, sql, params))
+                elif kind == 'geometry':
+                    geometry = (sql, params)
+                else:
+                    properties.append((name, sql, params))
+            feature.append(('properties',) + build_object(properties))
+            if geometry:
+                feature.append(('geometry',) + geometry)
+            obj_sql, obj_params = build_object(feature)
+        else:
+            obj_sql, obj_params = build_object([
+                (name, sql, params) for name, kind, sql, params in expressions
+            ])
+
+        compiler = queryset.query.get_compiler(queryset.db)
+        query_sql, query_params = compiler.as_sql()
+        if len(compiler.select) != len(self.lookups):
+            self.json_unsupported = "extra columns"
+            return None
+        order_sql = self.get_json_order(compiler)
+        if order_sql is None:
+            self.json_unsupported = "its ordering"
+            return None
+        sql = (
+            "SELECT COALESCE(json_agg(%s%s), '[]'::json)::text"
+            " FROM (%s) AS wq_rows (%s)" % (
+                obj_sql, order_sql, query_sql, ', '.join(
+                    'c%s' % i for i in range(len(compiler.select))
+                )
+            )
+        )
+        return sql, tuple(obj_params) + tuple(query_params)
+
+    def get_json_order(self, compiler):
+        """
+        Return an ORDER BY clause for json_agg() matching the query's
+        ordering (which an aggregate over a subquery does not otherwise
+        preserve), in terms of the selected columns.  Returns None if the
+        query is ordered by anything other than selected columns.
+        """
+        columns = [sql for col, (sql, params), alias in compiler.select]
+        terms = []
+        for expr, (sql, params, is_ref) in compiler.get_order_by():
+            if is_ref:
+                return None
+            column_sql, column_params = compiler.compile(expr.expression)
+            if column_params or column_sql not in columns:
+                return None
+            terms.append('wq_rows.c%s %s' % (
+                columns.index(column_sql),
+                'DESC' if expr.descending else 'ASC',
+            ))
+        if not terms:
+            return ''
+        return ' ORDER BY ' + ', '.join(terms)
+
+    def can_render_json(self, queryset, geojson=False):
+        """
+        Whether render_json() supports the fields and ordering of queryset
+        (otherwise json_unsupported indicates why not).
+        """
+        try:
+            return self.get_json_sql(queryset, geojson) is not None
+        except EmptyResultSet:
+            return True
+
+    def render_json(self, queryset, geojson=False):
+        """
+        Render queryset rows to JSON in the database, returning a RawJSON
+        fragment for the renderers (or None if not supported).
+        """
+        from django.db import connections
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        try:
+            result = self.get_json_sql(queryset, geojson)
+        except EmptyResultSet:
+            return RawJSON('[]')
+        if result is None:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(*result)
+            return RawJSON(cursor.fetchone()[0])
+
+    def to_representation(self, rows):
+        db = getattr(rows, 'db', None) or self.model._default_manager.db
+        rows = list(rows)
+        related_objects = self.get_related_objects(rows)
+        result = []
+        for row in rows:
+            instance = None
+            if self.instance_fields:
+                instance = self.get_instance(row, db, related_objects)
+            data = OrderedDict()
+            for name, kind, key, field, model_field in self.fields:
+                if kind in ('value', 'geometry'):
+                    value = row[key]
+                elif kind == 'display':
+                    value = row[key[0]]
+                    value = force_text(
+                        key[1].get(value, value), strings_only=True
+                    )
+                elif kind == 'related':
+                    value = row[key]
+                    if value is not None:
+                        value = related_objects[key].get(value, None)
+                else:
+                    value = instance.__str__()
+
+                if value is None:
+                    data[name] = None
+                elif field is None:
+                    data[name] = value
+                else:
+                    data[name] = field.to_representation(value)
+            result.append(data)
+        return result
+
+
 class BaseModelSerializer(JSONFormSerializer, serializers.ModelSerializer):
     xlsform_types = {
         serializers.FileField: 'binary',
@@ -193,7 +553,7 @@ class ModelSerializer(BaseModelSerializer):
         request = self.context.get('request', None)
         if not request:
             return
-        if request.accepted_renderer.format == 'geojson':
+        if request.accepted_renderer.format in ('geojson', 'topojson'):
             return True
         return False
 
@@ -292,6 +652,337 @@ class ModelSerializer(BaseModelSerializer):
 
         return fields
 
+    def get_query_plan(self, prefix=''):
+        """
+        Determine the select_related() and prefetch_related() lookups needed
+        to serialize this model's fields without per-row queries.
+        """
+        select = []
+        prefetch = OrderedDict()
+        model = self.Meta.model
+        for field in self.fields.values():
+            if field.write_only or not field.source_attrs:
+                continue
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            if not model_field.is_relation:
+                continue
+            lookup = prefix + model_field.name
+
+            if isinstance(field, serializers.ListSerializer):
+                # Nested one-to-many (e.g. attachments)
+                child = field.child
+                queryset = child.Meta.model._default_manager.all()
+                if hasattr(child, 'get_query_annotations'):
+                    annotations = child.get_query_annotations()
+                    if annotations:
+                        queryset = queryset.annotate(**annotations)
+                if hasattr(child, 'get_query_plan'):
+                    child_select, child_prefetch = child.get_query_plan()
+                    if child_select:
+                        queryset = queryset.select_related(*child_select)
+                    if child_prefetch:
+                        queryset = queryset.prefetch_related(*child_prefetch)
+                prefetch[lookup] = Prefetch(lookup, queryset=queryset)
+            elif isinstance(field, serializers.ManyRelatedField):
+                prefetch.setdefault(lookup, lookup)
+            elif model_field.one_to_one or (
+                    model_field.many_to_one and model_field.concrete):
+                # Foreign key (id, label, or nested parent object)
+                if lookup not in select:
+                    select.append(lookup)
+                if hasattr(field, 'get_query_plan'):
+                    child_select, child_prefetch = field.get_query_plan(
+                        lookup + '__'
+                    )
+                    select.extend(
+                        name for name in child_select if name not in select
+                    )
+                    for child_lookup in child_prefetch:
+                        name = getattr(
+                            child_lookup, 'prefetch_to', child_lookup
+                        )
+                        prefetch.setdefault(name, child_lookup)
+        return select, list(prefetch.values())
+
+    compiled_field_types = (
+        serializers.BooleanField,
+        serializers.NullBooleanField,
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.FloatField,
+        serializers.DecimalField,
+        serializers.DateField,
+        serializers.DateTimeField,
+        serializers.TimeField,
+        serializers.ChoiceField,
+        serializers.ReadOnlyField,
+        IDRelatedField,
+        LabelRelatedField,
+    )
+
+    def compile_list(self, allow_geometry=False):
+        """
+        Compile the list-mode fields into a CompiledListSerializer, or
+        return None if any field needs the regular serializer.  Geometry
+        fields are only compiled for database-side JSON rendering.
+        """
+        if self.is_detail:
+            return None
+        if type(self).to_representation != ModelSerializer.to_representation:
+            return None
+
+        model = self.Meta.model
+        lookups = []
+        fields = []
+        related = OrderedDict()
+        needs_instance = False
+
+        def add_lookup(lookup):
+            if lookup not in lookups:
+                lookups.append(lookup)
+
+        for field in self._readable_fields:
+            source = field.source_attrs
+            if isinstance(field, GeometryField):
+                if not allow_geometry:
+                    return None
+            elif not isinstance(field, self.compiled_field_types):
+                return None
+            if isinstance(field, GeometryField):
+                pass
+            elif type(field).get_attribute != serializers.Field.get_attribute:
+                if not isinstance(field, serializers.RelatedField):
+                    return None
+                if field.use_pk_only_optimization():
+                    return None
+            if len(source) != 1:
+                return None
+            source = source[0]
+
+            if source == '__str__':
+                if not isinstance(field, serializers.ReadOnlyField):
+                    return None
+                needs_instance = True
+                fields.append((field.field_name, 'str', None, field, None))
+                continue
+
+            if source.startswith('get_') and source.endswith('_display'):
+                try:
+                    model_field = model._meta.get_field(source[4:-8])
+                except FieldDoesNotExist:
+                    return None
+                if not model_field.choices or model_field.is_relation:
+                    return None
+                add_lookup(model_field.name)
+                fields.append((
+                    field.field_name, 'display',
+                    (model_field.name, dict(model_field.flatchoices)),
+                    self.get_compiled_field(field), model_field
+                ))
+                continue
+
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                return None
+            if not model_field.concrete:
+                return None
+
+            if isinstance(model_field, model_fields.GeometryField):
+                if not isinstance(field, GeometryField):
+                    return None
+                add_lookup(model_field.name)
+                fields.append((
+                    field.field_name, 'geometry', model_field.name, field,
+                    model_field
+                ))
+                continue
+            elif isinstance(field, GeometryField):
+                return None
+
+            if not model_field.is_relation:
+                if isinstance(field, serializers.RelatedField):
+                    return None
+                add_lookup(model_field.name)
+                fields.append((
+                    field.field_name, 'value', model_field.name,
+                    self.get_compiled_field(field), model_field
+                ))
+                continue
+
+            if not (model_field.many_to_one or model_field.one_to_one):
+                return None
+            rel_model = model_field.rel.to
+            if model_field.to_fields[0] not in (None, rel_model._meta.pk.name):
+                return None
+
+            if isinstance(field, IDRelatedField):
+                from .routers import router
+                lookup = router.get_lookup_for_model(rel_model)
+                if lookup in ('pk', rel_model._meta.pk.name):
+                    lookup = model_field.name
+                    target_field = model_field
+                else:
+                    try:
+                        target_field = rel_model._meta.get_field(lookup)
+                    except FieldDoesNotExist:
+                        return None
+                    lookup = model_field.name + '__' + lookup
+                add_lookup(lookup)
+                fields.append((
+                    field.field_name, 'value', lookup, None, target_field
+                ))
+            elif isinstance(field, LabelRelatedField):
+                add_lookup(model_field.name)
+                related[model_field.name] = model_field
+                fields.append((
+                    field.field_name, 'related', model_field.name, field,
+                    model_field
+                ))
+            else:
+                return None
+
+        instance_fields = []
+        if needs_instance:
+            instance_fields = list(model._meta.concrete_fields)
+            for model_field in instance_fields:
+                if isinstance(model_field, model_fields.GeometryField):
+                    return None
+                add_lookup(model_field.name)
+            for model_field in instance_fields:
+                # Preload parents in case __str__() refers to them
+                if model_field.is_relation and model_field.to_fields[0] in (
+                        None, model_field.rel.to._meta.pk.name):
+                    related.setdefault(model_field.name, model_field)
+
+        # Zoom tolerances are in the units of each geometry's SRID
+        srids = set(
+            model_field.srid for name, kind, key, field, model_field
+            in fields if kind == 'geometry'
+        )
+        if len(srids) > 1:
+            return None
+
+        return CompiledListSerializer(
+            model, lookups, fields, related, instance_fields,
+            self.get_geometry_options(srids.pop() if srids else None),
+        )
+
+    def get_compiled_field(self, field):
+        # ReadOnlyField.to_representation() returns the value as is
+        if type(field) is serializers.ReadOnlyField:
+            return None
+        return field
+
+    def get_query_annotations(self):
+        """
+        Annotate geometry fields with their GeoJSON text, so that GeometryField
+        can output it without a parse/dump round-trip.
+        """
+        if AsGeoJSON is None:
+            return {}
+        model = self.Meta.model
+        annotations = {}
+        for field in self.fields.values():
+            if field.write_only or not isinstance(field, GeometryField):
+                continue
+            if len(field.source_attrs) != 1:
+                continue
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            if not isinstance(model_field, model_fields.GeometryField):
+                continue
+            annotations[GEOJSON_ANNOTATION % model_field.name] = (
+                self.get_geojson_annotation(
+                    model_field.name, model_field.srid,
+                    self.get_geometry_options(model_field.srid),
+                )
+            )
+        return annotations
+
+    def get_geojson_annotation(self, geometry, srid, options):
+        """
+        AsGeoJSON() expression for the geometry at the given lookup, with
+        the tolerance and precision from get_geometry_options().
+        """
+        if options['tolerance']:
+            geometry = SimplifyPreserveTopology(
+                F(geometry), Value(options['tolerance']),
+                output_field=model_fields.GeometryField(srid=srid),
+            )
+        return AsGeoJSON(geometry, precision=options['precision'])
+
+    def get_geometry_options(self, srid=None):
+        """
+        Parse the tolerance (or zoom) and precision query parameters, used
+        to simplify geometries and round coordinates in GeoJSON output.
+        Zoom levels are converted to a tolerance in the units of srid
+        (default: settings.SRID).
+        """
+        options = {'tolerance': None, 'precision': 15}
+        request = self.context.get('request', None)
+        if not request or not self.is_geojson:
+            return options
+        params = request.GET
+        try:
+            if params.get('tolerance'):
+                options['tolerance'] = float(params['tolerance'])
+            elif params.get('zoom'):
+                zoom = int(params['zoom'])
+        except ValueError:
+            raise serializers.ValidationError({
+                'tolerance': "Invalid tolerance or zoom"
+            })
+        if options['tolerance'] is None and params.get('zoom'):
+            try:
+                options['tolerance'] = get_zoom_tolerance(zoom, srid)
+            except ValueError as e:
+                raise serializers.ValidationError({'zoom': str(e)})
+        try:
+            if params.get('precision'):
+                precision = int(params['precision'])
+                options['precision'] = min(max(precision, 0), 15)
+        except ValueError:
+            raise serializers.ValidationError({
+                'precision': "Invalid precision"
+            })
+        if options['tolerance'] is not None and options['tolerance'] <= 0:
+            options['tolerance'] = None
+        return options
+
+    def build_instance(self, validated_data, instance=None):
+        """
+        Return an unsaved instance for use with bulk_create(), or None if
+        the data needs to be written with save().
+        """
+        if instance is None:
+            if type(self).create != ModelSerializer.create:
+                return None
+        elif type(self).update != ModelSerializer.update:
+            return None
+        if type(self).save != ModelSerializer.save:
+            return None
+        return self.build_model_instance(validated_data, instance)
+
+    def build_model_instance(self, validated_data, instance=None):
+        model = self.Meta.model
+        if model.save != model_fields.Model.save:
+            return None
+        info = model_meta.get_field_info(model)
+        for name, relation in info.relations.items():
+            if relation.to_many and name in validated_data:
+                return None
+        if instance is None:
+            return model(**validated_data)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        return instance
+
     @classmethod
     def for_model(cls, model_class):
         class Serializer(cls):
@@ -0,0 +1,293 @@
+import math
+
+from django.contrib.contenttypes.fields import GenericRelation
+from django.contrib.gis.db import models as model_fields
+from django.db import connections
+from django.db.models.fields import FieldDoesNotExist
+
+from .model_tools import get_ct
+
+
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+WEB_MERCATOR_SIZE = 2 * math.pi * 6378137
+ENVELOPE = 'ST_MakeEnvelope(%s, %s, %s, %s, 3857)'
+
+NUMERIC_TYPES = (
+    'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+    'SmallIntegerField', 'PositiveIntegerField', 'PositiveSmallIntegerField',
+    'FloatField', 'BooleanField', 'NullBooleanField',
+)
+
+
+def get_tile_bounds(z, x, y):
+    """
+    Return the (xmin, ymin, xmax, ymax) of an XYZ tile in web mercator.
+    """
+    size = WEB_MERCATOR_SIZE / 2 ** z
+    xmin = -WEB_MERCATOR_SIZE / 2 + x * size
+    ymax = WEB_MERCATOR_SIZE / 2 - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def get_geometry_field(model):
+    for field in model._meta.concrete_fields:
+        if isinstance(field, model_fields.GeometryField):
+            return field
+    return None
+
+
+def get_tile_source(model):
+    """
+    Determine where tile geometries for model come from: either a geometry
+    field on the model itself, or a generic relation to a model with one
+    (e.g. the locations of a LocatedModel).  Returns (relation, field), or
+    None if the model has no geometries.
+    """
+    field = get_geometry_field(model)
+    if field:
+        return None, field
+    relations = getattr(
+        model._meta, 'private_fields', None
+    ) or getattr(model._meta, 'virtual_fields', [])
+    for relation in relations:
+        if not isinstance(relation, GenericRelation):
+            continue
+        field = get_geometry_field(relation.rel.to)
+        if field:
+            return relation, field
+    return None
+
+
+def get_tile_dependencies(model):
+    source = get_tile_source(model)
+    models = set([model._meta.concrete_model])
+    if source and source[0]:
+        models.add(source[0].rel.to._meta.concrete_model)
+    return models
+
+
+def get_tile_fields(model, names):
+    fields = []
+    for name in names or []:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not field.concrete or field.is_relation and not field.many_to_one:
+            continue
+        if isinstance(field, model_fields.GeometryField):
+            continue
+        fields.append(field)
+    return fields
+
+
+def get_tile_range(bounds, z):
+    """
+    Return the (xmin, ymin, xmax, ymax) XYZ tile numbers covering the given
+    web mercator bounds at zoom level z.
+    """
+    count = 2 ** z
+    size = WEB_MERCATOR_SIZE / count
+
+    def clamp(num):
+        return min(max(int(math.floor(num)), 0), count - 1)
+
+    xmin, ymin, xmax, ymax = bounds
+    origin = WEB_MERCATOR_SIZE / 2
+    return (
+        clamp((xmin + origin) / size),
+        clamp((origin - ymax) / size),
+        clamp((xmax + origin) / size),
+        clamp((origin - ymin) / size),
+    )
+
+
+def get_geometry_sql(queryset, lookup='pk', fields=None):
+    """
+    Build a query returning the object id (lookup), the given model fields,
+    and a "geom" column for each row of queryset (one row per location for
+    located models).  Returns (sql, params, srid, field_names).
+    """
+    model = queryset.model
+    relation, geometry = get_tile_source(model)
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+
+    if lookup == 'pk':
+        lookup = model._meta.pk.name
+    fields = get_tile_fields(model, fields)
+    lookups = []
+
+    def column(name):
+        if name not in lookups:
+            lookups.append(name)
+        return 'obj.c%s' % lookups.index(name)
+
+    pk_column = column(model._meta.pk.name)
+    names = ['id']
+    attributes = ['%s AS "id"' % column(lookup)]
+    for field in fields:
+        sql = column(field.name)
+        if field.get_internal_type() not in NUMERIC_TYPES:
+            sql += '::text'
+        names.append(field.name)
+        attributes.append('%s AS %s' % (sql, qn(field.name)))
+
+    if relation:
+        rel_model = relation.rel.to
+        geom_column = 'rel.%s' % qn(geometry.column)
+        join = (
+            ' JOIN %s AS rel ON rel.%s = %s AND rel.%s = %%s' % (
+                qn(rel_model._meta.db_table),
+                qn(rel_model._meta.get_field(
+                    relation.object_id_field_name
+                ).column),
+                pk_column,
+                qn(rel_model._meta.get_field(
+                    relation.content_type_field_name
+                ).column),
+            )
+        )
+        join_params = [get_ct(model, for_concrete_model=True).pk]
+    else:
+        geom_column = column(geometry.name)
+        join = ''
+        join_params = []
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    query_sql, query_params = queryset.values(*lookups).query.sql_with_params()
+    columns = ['c%s' % i for i in range(len(lookups))]
+    sql = (
+        'SELECT {attributes}, {geom} AS geom'
+        ' FROM ({query}) AS obj ({columns}){join}'
+    ).format(
+        attributes=', '.join(attributes),
+        geom=geom_column,
+        query=query_sql,
+        columns=', '.join(columns),
+        join=join,
+    )
+    params = list(query_params) + join_params
+    return sql, params, int(geometry.srid), names
+
+
+def render_tile(queryset, z, x, y, layer, lookup='pk', fields=None):
+    """
+    Render the rows of queryset that intersect tile z/x/y as a Mapbox Vector
+    Tile with PostGIS' ST_AsMVT(), with the object id (lookup) and the given
+    model fields as feature attributes.
+    """
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    source_sql, source_params, srid, names = get_geometry_sql(
+        queryset, lookup, fields
+    )
+    bounds = list(get_tile_bounds(z, x, y))
+    sql = (
+        "SELECT ST_AsMVT(tile, %s, {extent}, 'geom') FROM ("
+        " SELECT ST_AsMVTGeom("
+        "ST_Transform(src.geom, 3857), {envelope}, {extent}, {buffer}, true"
+        ") AS geom, {attributes}"
+        " FROM ({source}) AS src"
+        " WHERE src.geom && ST_Transform({envelope}, {srid})"
+        ") AS tile WHERE tile.geom IS NOT NULL"
+    ).format(
+        extent=MVT_EXTENT,
+        buffer=MVT_BUFFER,
+        envelope=ENVELOPE,
+        attributes=', '.join('src.%s' % qn(name) for name in names),
+        source=source_sql,
+        srid=srid,
+    )
+    params = [layer] + bounds + source_params + bounds
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        tile = cursor.fetchone()[0]
+    return bytes(tile or b'')
+
+
+def cluster_tile(queryset, z, x, y, cells=4, lookup='pk'):
+    """
+    Group the rows of queryset within tile z/x/y into a cells x cells grid
+    (with ST_SnapToGrid) and return the count, centroid (in WGS84) and a
+    representative id for each non-empty grid cell.
+    """
+    connection = connections[queryset.db]
+    source_sql, source_params, srid, names = get_geometry_sql(
+        queryset, lookup
+    )
+    bounds = list(get_tile_bounds(z, x, y))
+    xmin, ymin, xmax, ymax = bounds
+    size = (xmax - xmin) / cells
+    sql = (
+        "SELECT COUNT(DISTINCT pt.id), MIN(pt.id),"
+        " ST_X(ST_Transform(ST_Centroid(ST_Collect(pt.geom)), 4326)),"
+        " ST_Y(ST_Transform(ST_Centroid(ST_Collect(pt.geom)), 4326))"
+        " FROM ("
+        " SELECT src.id, ST_Centroid(ST_Transform(src.geom, 3857)) AS geom"
+        " FROM ({source}) AS src"
+        " WHERE src.geom && ST_Transform({envelope}, {srid})"
+        ") AS pt"
+        " WHERE ST_X(pt.geom) >= %s AND ST_X(pt.geom) < %s"
+        " AND ST_Y(pt.geom) >= %s AND ST_Y(pt.geom) < %s"
+        " GROUP BY ST_SnapToGrid(pt.geom, %s, %s, %s, %s)"
+    ).format(
+        source=source_sql,
+        envelope=ENVELOPE,
+        srid=srid,
+    )
+    params = source_params + bounds + [
+        xmin, xmax, ymin, ymax,
+        xmin + size / 2, ymin + size / 2, size, size,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [{
+        'id': ident,
+        'count': count,
+        'longitude': longitude,
+        'latitude': latitude,
+    } for count, ident, longitude, latitude in rows]
+
+
+def get_distance_sql(queryset, point):
+    """
+    Build an SQL expression for the geography distance (in meters) from
+    each row of queryset to point (a GEOS Point), for use as an annotation.
+    For located models this is the distance to the nearest location.
+    Returns (sql, params).
+    """
+    model = queryset.model
+    relation, geometry = get_tile_source(model)
+    qn = connections[queryset.db].ops.quote_name
+    distance = (
+        'ST_Distance(ST_Transform({geom}, 4326)::geography,'
+        ' ST_Transform(ST_GeomFromEWKT(%s), 4326)::geography)'
+    )
+    pk_column = '%s.%s' % (
+        qn(model._meta.db_table), qn(model._meta.pk.column)
+    )
+    if not relation:
+        sql = distance.format(geom='%s.%s' % (
+            qn(model._meta.db_table), qn(geometry.column)
+        ))
+        return sql, [point.ewkt]
+
+    rel_model = relation.rel.to
+    sql = (
+        '(SELECT MIN({distance}) FROM {table} AS loc'
+        ' WHERE loc.{ct} = %s AND loc.{id} = {pk})'
+    ).format(
+        distance=distance.format(geom='loc.%s' % qn(geometry.column)),
+        table=qn(rel_model._meta.db_table),
+        ct=qn(rel_model._meta.get_field(
+            relation.content_type_field_name
+        ).column),
+        id=qn(rel_model._meta.get_field(
+            relation.object_id_field_name
+        ).column),
+        pk=pk_column,
+    )
+    return sql, [point.ewkt, get_ct(model, for_concrete_model=True).pk]
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+
+
+DEFAULT_QUANTIZATION = 100000
+MIN_QUANTIZATION = 2
+MAX_QUANTIZATION = 10 ** 9
+
+
+class Topology(object):
+    """
+    Convert GeoJSON features to a TopoJSON topology: coordinates are
+    quantized to a grid, and lines and polygon rings are cut at junctions
+    into arcs, so that boundaries shared by adjacent polygons are stored
+    only once.
+    """
+    def __init__(self, features, quantization=DEFAULT_QUANTIZATION):
+        if not MIN_QUANTIZATION <= quantization <= MAX_QUANTIZATION:
+            raise ValueError(
+                "quantization must be between %s and %s"
+                % (MIN_QUANTIZATION, MAX_QUANTIZATION)
+            )
+        self.features = features
+        self.quantization = quantization
+        self.lines = []
+        self.arcs = []
+        self.arc_index = {}
+        self.junctions = set()
+
+    def get_bbox(self):
+        xs, ys = [], []
+
+        def visit(coords):
+            if not coords:
+                return
+            if not isinstance(coords[0], (list, tuple)):
+                if coords[0] is not None and coords[1] is not None:
+                    xs.append(coords[0])
+                    ys.append(coords[1])
+            else:
+                for child in coords:
+                    visit(child)
+
+        for geometry in self.iter_geometries():
+            visit(geometry.get('coordinates', []))
+        if not xs:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def iter_geometries(self, geometries=None):
+        if geometries is None:
+            geometries = [
+                feature.get('geometry', None) for feature in self.features
+            ]
+        for geometry in geometries:
+            if not geometry:
+                continue
+            if geometry.get('type', None) == 'GeometryCollection':
+                for child in self.iter_geometries(geometry['geometries']):
+                    yield child
+            else:
+                yield geometry
+
+    def get_transform(self, bbox):
+        x0, y0, x1, y1 = bbox
+        steps = self.quantization - 1
+        return {
+            'scale': [
+                (x1 - x0) / steps if x1 > x0 else 1,
+                (y1 - y0) / steps if y1 > y0 else 1,
+            ],
+            'translate': [x0, y0],
+        }
+
+    def quantize_point(self, point):
+        kx, ky = self.transform['scale']
+        x0, y0 = self.transform['translate']
+        return (
+            int(round((point[0] - x0) / kx)),
+            int(round((point[1] - y0) / ky)),
+        )
+
+    def quantize_line(self, points):
+        line = []
+        for point in points:
+            point = self.quantize_point(point)
+            # Vertices closer than the grid size collapse together
+            if not line or line[-1] != point:
+                line.append(point)
+        return line
+
+    def add_line(self, points, ring):
+        """
+        Quantize and register a line (or ring), returning its index, or None
+        if it has collapsed to a single grid point (or a ring to fewer than
+        three distinct points) and should be dropped.
+        """
+        line = self.quantize_line(points)
+        if ring and line and line[0] != line[-1]:
+            line.append(line[0])
+        if len(line) < (4 if ring else 2):
+            return None
+        self.lines.append((line, ring))
+        return len(self.lines) - 1
+
+    def add_lines(self, lines, ring):
+        indexes = [self.add_line(line, ring) for line in lines]
+        return [index for index in indexes if index is not None]
+
+    def add_polygon(self, rings):
+        # Holes lie within the exterior ring, so drop the whole polygon if
+        # the exterior has collapsed
+        if not rings or self.add_line(rings[0], True) is None:
+            return []
+        return [len(self.lines) - 1] + self.add_lines(rings[1:], True)
+
+    def find_junctions(self):
+        """
+        A point is a junction if it is the end of a line, or if it is
+        reached from different neighbors by different lines (i.e. where
+        shared boundaries begin or end).
+        """
+        neighbors = {}
+        junctions = self.junctions
+        for line, ring in self.lines:
+            points = line[:-1] if ring else line
+            count = len(points)
+            for i, point in enumerate(points):
+                if ring:
+                    pair = (points[i - 1], points[(i + 1) % count])
+                elif i == 0 or i == count - 1:
+                    junctions.add(point)
+                    continue
+                else:
+                    pair = (points[i - 1], points[i + 1])
+                if pair[1] < pair[0]:
+                    pair = (pair[1], pair[0])
+                seen = neighbors.setdefault(point, pair)
+                if seen != pair:
+                    junctions.add(point)
+
+    def cut_line(self, line, ring):
+        if ring:
+            points = line[:-1]
+            starts = [
+                i for i, point in enumerate(points) if point in self.junctions
+            ]
+            # Rotate rings to start at a junction, or at a consistent point
+            # so that identical rings are detected as duplicates
+            start = starts[0] if starts else points.index(min(points))
+            line = points[start:] + points[:start] + [points[start]]
+            if not starts:
+                return [line]
+        arcs = []
+        arc = [line[0]]
+        for point in line[1:]:
+            arc.append(point)
+            if point in self.junctions:
+                arcs.append(arc)
+                arc = [point]
+        if len(arc) > 1:
+            arcs.append(arc)
+        return arcs
+
+    def get_arc(self, arc):
+        """
+        Return the index of arc (or ~index if it is an existing arc in
+        reverse), adding it to the topology if needed.
+        """
+        key = tuple(arc)
+        if key in self.arc_index:
+            return self.arc_index[key]
+        reverse = key[::-1]
+        if reverse in self.arc_index:
+            return ~self.arc_index[reverse]
+        self.arc_index[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return self.arc_index[key]
+
+    def get_line_arcs(self, index):
+        line, ring = self.lines[index]
+        return [self.get_arc(arc) for arc in self.cut_line(line, ring)]
+
+    def extract(self, geometry):
+        """
+        Replace the coordinates of geometry with line (or point) references
+        to be resolved to arcs once all junctions are known.
+        """
+        if not geometry:
+            return {'type': None}
+        geom_type = geometry.get('type', None)
+        coords = geometry.get('coordinates', None)
+        if geom_type == 'Point' and None in coords[:2]:
+            return {'type': None}
+        result = OrderedDict([('type', geom_type)])
+        if geom_type == 'GeometryCollection':
+            result['geometries'] = [
+                self.extract(child) for child in geometry['geometries']
+            ]
+        elif geom_type == 'Point':
+            result['coordinates'] = list(self.quantize_point(coords))
+        elif geom_type == 'MultiPoint':
+            result['coordinates'] = [
+                list(self.quantize_point(point)) for point in coords
+            ]
+        elif geom_type == 'LineString':
+            result['arcs'] = self.add_line(coords, False)
+        elif geom_type == 'MultiLineString':
+            result['arcs'] = self.add_lines(coords, False)
+        elif geom_type == 'Polygon':
+            result['arcs'] = self.add_polygon(coords)
+        elif geom_type == 'MultiPolygon':
+            polygons = [self.add_polygon(polygon) for polygon in coords]
+            result['arcs'] = [polygon for polygon in polygons if polygon]
+        else:
+            return {'type': None}
+        if result.get('arcs', 0) in (None, []):
+            # Every line or ring was smaller than the quantization grid
+            return {'type': None}
+        return result
+
+    def resolve(self, geometry):
+        geom_type = geometry['type']
+        if geom_type == 'GeometryCollection':
+            for child in geometry['geometries']:
+                self.resolve(child)
+        elif geom_type == 'LineString':
+            geometry['arcs'] = self.get_line_arcs(geometry['arcs'])
+        elif geom_type in ('MultiLineString', 'Polygon'):
+            geometry['arcs'] = [
+                self.get_line_arcs(line) for line in geometry['arcs']
+            ]
+        elif geom_type == 'MultiPolygon':
+            geometry['arcs'] = [
+                [self.get_line_arcs(ring) for ring in polygon]
+                for polygon in geometry['arcs']
+            ]
+
+    def encode_arc(self, arc):
+        # Delta-encode positions relative to the previous position
+        encoded = []
+        x0, y0 = 0, 0
+        for x, y in arc:
+            encoded.append([x - x0, y - y0])
+            x0, y0 = x, y
+        return encoded
+
+    def to_topojson(self, name):
+        bbox = self.get_bbox()
+        self.transform = self.get_transform(bbox or (0, 0, 0, 0))
+
+        geometries = []
+        for feature in self.features:
+            geometry = self.extract(feature.get('geometry', None))
+            if feature.get('id', None) is not None:
+                geometry['id'] = feature['id']
+            if feature.get('properties', None):
+                geometry['properties'] = feature['properties']
+            geometries.append(geometry)
+
+        self.find_junctions()
+        for geometry in geometries:
+            self.resolve(geometry)
+
+        topology = OrderedDict([('type', 'Topology')])
+        if bbox:
+            topology['bbox'] = list(bbox)
+        topology['transform'] = self.transform
+        topology['objects'] = {
+            name: {'type': 'GeometryCollection', 'geometries': geometries}
+        }
+        topology['arcs'] = [self.encode_arc(arc) for arc in self.arcs]
+        return topology
@@ -2,8 +2,35 @@ from rest_framework.generics import GenericAPIView as RestGenericAPIView
 from rest_framework.response import Response
 from rest_framework.decorators import detail_route
 from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import BasePermission, SAFE_METHODS
+from rest_framework.settings import api_settings
 from .model_tools import get_ct, get_object_id, get_by_identifier
+from .renderers import JSONRenderer, MVTRenderer
+from .serializers import MIN_ZOOM, MAX_ZOOM
+from .tiles import (
+    render_tile, cluster_tile, get_tile_range, WEB_MERCATOR_SIZE
+)
+from django.db import connections
+from django.db.models import QuerySet
 from django.db.models.fields import FieldDoesNotExist
+from django.contrib.gis.geos import Polygon
+from django.http import StreamingHttpResponse, Http404
+from django.utils import timezone
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import islice
+import warnings
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class GenericAPIView(RestGenericAPIView):
@@ -29,14 +56,52 @@ class GenericAPIView(RestGenericAPIView):
 
     def get_queryset(self):
         if self.router is not None and self.model is not None:
-            return self.router.get_queryset_for_model(self.model, self.request)
+            queryset = self.router.get_queryset_for_model(
+                self.model, self.request
+            )
+            return self.plan_queryset(queryset)
         return super(GenericAPIView, self).get_queryset()
 
+    def plan_queryset(self, queryset):
+        """
+        Apply select_related() / prefetch_related() for the related fields
+        that the serializer will output.
+        """
+        serializer_class = self.get_serializer_class()
+        if not hasattr(serializer_class, 'get_query_plan'):
+            return queryset
+        serializer = serializer_class(context=self.get_serializer_context())
+        # Annotations are only for output; instances loaded for PUT/PATCH
+        # would return the GeoJSON from before the update
+        if hasattr(serializer, 'get_query_annotations') and (
+                self.request.method in SAFE_METHODS):
+            annotations = serializer.get_query_annotations()
+            if annotations:
+                queryset = queryset.annotate(**annotations)
+        select, prefetch = serializer.get_query_plan()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
     def get_serializer_class(self):
         if self.router is not None and self.model is not None:
             return self.router.get_serializer_for_model(self.model, self.depth)
         return super(GenericAPIView, self).get_serializer_class()
 
+    @property
+    def renders_raw_json(self):
+        # Pre-encoded JSON (see renderers.RawJSON) can only be output by
+        # wq.db's JSON renderers
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return isinstance(renderer, JSONRenderer)
+
+    def get_serializer_context(self):
+        context = super(GenericAPIView, self).get_serializer_context()
+        context['raw_json'] = self.renders_raw_json
+        return context
+
 
 class SimpleView(GenericAPIView):
     def get(self, request, *args, **kwargs):
@@ -47,9 +112,32 @@ class SimpleViewSet(viewsets.ViewSet, GenericAPIView):
     def list(self, request, *args, **kwargs):
         return Response({})
 
+    def etag_response(self, request, data, content_hash):
+        """
+        Return data with a strong ETag (or 304 Not Modified if the client
+        already has it).  HTML responses are skipped since their templates
+        include request-specific context such as the CSRF token.
+        """
+        format = request.accepted_renderer.format
+        if format == 'html':
+            return Response(data)
+        etag = '"%s.%s"' % (content_hash, format)
+        match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [tag.strip() for tag in match.split(',')]:
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED,
+                headers={'ETag': etag},
+            )
+        return Response(data, headers={'ETag': etag})
+
 
 class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
     target = None
+    db_render = False
+    stream_geojson = False
+    stream_chunk_size = 500
+    cluster_cells = 4
+    cluster_max_tiles = 64
 
     @property
     def template_name(self):
@@ -120,9 +208,45 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
         if self.kwargs.get(lookup, "") == "new":
             # new/edit mode
             return self.new(request)
-        else:
-            # Normal detail view
-            return super(ModelViewSet, self).retrieve(request, *args, **kwargs)
+
+        # Normal detail view
+        instance = None
+        if self.has_object_permissions():
+            # Check object permissions even if the response is cached
+            instance = self.get_object()
+        response = self.get_cached_response()
+        if response is None:
+            if instance is None:
+                response = super(ModelViewSet, self).retrieve(
+                    request, *args, **kwargs
+                )
+            else:
+                response = Response(self.get_serializer(instance).data)
+            self.set_cached_response(response)
+        return response
+
+    def has_object_permissions(self):
+        base = BasePermission.has_object_permission
+        for permission in self.get_permissions():
+            check = type(permission).has_object_permission
+            if getattr(check, '__func__', check) is not getattr(
+                    base, '__func__', base):
+                return True
+        return False
+
+    def get_cached_response(self):
+        if not self.router:
+            return None
+        data = self.router.get_cached_response(self.model, self.request)
+        if data is None:
+            return None
+        return Response(data)
+
+    def set_cached_response(self, response):
+        if self.router and response.status_code == status.HTTP_200_OK:
+            self.router.set_cached_response(
+                self.model, self.request, response.data
+            )
 
     def add_lookups(self, context):
         # Mimic _addLookups in wq.app/app.js
@@ -170,19 +294,347 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
         return rest.router.serialize(qs, many=True)
 
     def list(self, request, *args, **kwargs):
-        response = super(ModelViewSet, self).list(
-            request, *args, **kwargs
-        )
-        if not isinstance(response.data, dict):
+        response = self.get_cached_response()
+        if response is not None:
             return response
 
+        if 'cluster' in request.GET and self.router and (
+                self.router.model_is_mapped(self.model)):
+            response = self.cluster_list()
+            if response is not None:
+                return response
+
+        if self.stream_geojson and request.accepted_renderer.format == (
+                'geojson'):
+            response = self.stream_list()
+            if response is not None:
+                return response
+
+        response = None
+        compiled = self.get_compiled_serializer()
+        if compiled is not None:
+            response = self.compiled_list(compiled)
+        if response is None:
+            response = super(ModelViewSet, self).list(
+                request, *args, **kwargs
+            )
+        if isinstance(response.data, dict):
+            self.add_list_context(response)
+
+        self.set_cached_response(response)
+        return response
+
+    def add_list_context(self, response):
         if self.target:
             response.data['target'] = self.target
         ct = get_ct(self.model)
         for pct, fields in ct.get_foreign_keys().items():
             if len(fields) == 1:
                 self.get_parent(pct, fields[0], response)
-        return response
+
+    def cluster_list(self):
+        """
+        Summarize the (filtered) list as point clusters for a map view
+        (?cluster=zoom&bbox=minx,miny,maxx,maxy[,srid]).  Clusters are
+        computed and cached per tile, so they depend only on the zoom level
+        and not on the exact extent.  Returns None if not using PostGIS.
+        """
+        request = self.request
+        try:
+            z = int(request.GET['cluster'])
+        except ValueError:
+            z = -1
+        if not 0 <= z <= 30:
+            raise ValidationError({'cluster': 'Invalid zoom level'})
+        xmin, ymin, xmax, ymax = get_tile_range(self.get_cluster_bounds(), z)
+        if (xmax - xmin + 1) * (ymax - ymin + 1) > self.cluster_max_tiles:
+            raise ValidationError({'bbox': 'Too many tiles for zoom level'})
+
+        # The extent is handled by the tile grid rather than by filters
+        self.ignore_kwargs = self.ignore_kwargs + ['bbox', 'cluster']
+        queryset = self.filter_queryset(self.get_queryset())
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+
+        params = sorted(
+            (key, values) for key, values in request.GET.lists()
+            if key != 'bbox'
+        )
+        clusters = []
+        for x in range(xmin, xmax + 1):
+            for y in range(ymin, ymax + 1):
+                tile_params = params + [('tile', [z, x, y])]
+                tile = self.router.get_cached_tile(
+                    self.model, request, tile_params
+                )
+                if tile is None:
+                    tile = cluster_tile(
+                        queryset, z, x, y,
+                        cells=self.cluster_cells,
+                        lookup=self.lookup_field,
+                    )
+                    self.router.set_cached_tile(
+                        self.model, request, tile, tile_params
+                    )
+                clusters.extend(tile)
+
+        return Response(OrderedDict([
+            ('cluster', z),
+            ('count', sum(cluster['count'] for cluster in clusters)),
+            ('list', clusters),
+        ]))
+
+    def get_cluster_bounds(self):
+        bbox = self.request.GET.get('bbox', None)
+        if not bbox:
+            return (
+                -WEB_MERCATOR_SIZE / 2, -WEB_MERCATOR_SIZE / 2,
+                WEB_MERCATOR_SIZE / 2, WEB_MERCATOR_SIZE / 2,
+            )
+        try:
+            numbers = [float(num) for num in bbox.split(',')]
+        except ValueError:
+            numbers = []
+        if len(numbers) not in (4, 5):
+            raise ValidationError({'bbox': 'Invalid bounding box'})
+        srid = int(numbers[4]) if len(numbers) > 4 else 4326
+        xmin, ymin, xmax, ymax = numbers[:4]
+        if srid == 4326:
+            # Web mercator is undefined at the poles
+            ymin, ymax = max(ymin, -85.0511), min(ymax, 85.0511)
+        extent = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+        extent.srid = srid
+        extent.transform(3857)
+        return extent.extent
+
+    def stream_list(self):
+        """
+        Stream a GeoJSON FeatureCollection, loading and serializing rows in
+        chunks of stream_chunk_size (by primary key) so that only one chunk
+        of rows is held in memory at a time.  (.iterator() alone is not
+        enough, since psycopg2 reads the entire result into memory without
+        a server-side cursor.)  Returns None if the renderer or pagination
+        class does not support streaming.
+        """
+        renderer = self.request.accepted_renderer
+        paginator = self.paginator
+        if not hasattr(renderer, 'render_stream'):
+            return None
+        if paginator is not None and not hasattr(paginator, 'get_page'):
+            return None
+
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = self.get_compiled_serializer()
+        if compiled is not None and not compiled.has_geometry:
+            queryset = compiled.get_queryset(queryset)
+            serialize = compiled.to_representation
+        else:
+            serialize = self.get_serializer(many=True).to_representation
+
+        response = Response(OrderedDict())
+        page = paginator and paginator.get_page(queryset, self.request)
+        if page is not None:
+            response.data = self.get_paginated_response([]).data
+            del response.data['list']
+            objs = page.object_list
+        else:
+            objs = queryset
+        self.add_list_context(response)
+
+        if isinstance(objs, QuerySet):
+            # Only the primary keys are loaded up front
+            pks = list(objs.values_list('pk', flat=True))
+
+            def chunks():
+                for chunk in iter_chunks(pks, self.stream_chunk_size):
+                    # Each chunk keeps the queryset ordering (and prefetches)
+                    yield list(queryset.filter(pk__in=chunk))
+        else:
+            # Already fetched by the paginator (to look ahead)
+            def chunks():
+                return iter_chunks(objs, self.stream_chunk_size)
+
+        def rows():
+            for chunk in chunks():
+                for row in serialize(chunk):
+                    yield row
+
+        return StreamingHttpResponse(
+            renderer.render_stream(response.data, rows()),
+            content_type=renderer.media_type,
+        )
+
+    def get_compiled_serializer(self):
+        """
+        Return a CompiledListSerializer for list views that can be rendered
+        from .values() rows, or None to use the regular serializer.
+        """
+        paginator = self.paginator
+        if paginator is not None and not isinstance(
+                paginator, PageNumberPagination):
+            # Cursor pagination reads positions from model instances
+            return None
+        serializer = self.get_serializer()
+        if not hasattr(serializer, 'compile_list'):
+            return None
+        return serializer.compile_list(allow_geometry=self.db_render)
+
+    def compiled_list(self, compiled):
+        queryset = compiled.get_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        format = self.request.accepted_renderer.format
+        if self.db_render and self.renders_raw_json and format in (
+                'json', 'geojson'):
+            response = self.db_list(compiled, queryset, format == 'geojson')
+            if response is not None:
+                return response
+        if compiled.has_geometry:
+            return None
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                compiled.to_representation(page)
+            )
+        return Response(compiled.to_representation(queryset))
+
+    def db_list(self, compiled, queryset, geojson):
+        """
+        Render the list in PostgreSQL (see CompiledListSerializer), or return
+        None if the fields or pagination class do not support it.
+        """
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        if not compiled.can_render_json(queryset, geojson):
+            self.warn_db_render(compiled)
+            return None
+        paginator = self.paginator
+        if paginator is not None and not hasattr(paginator, 'get_page'):
+            return None
+        page = paginator and paginator.get_page(queryset, self.request)
+        if page is None:
+            return Response(compiled.render_json(queryset, geojson))
+        if isinstance(page.object_list, QuerySet):
+            data = compiled.render_json(page.object_list, geojson)
+        else:
+            # Already fetched by the paginator (to look ahead)
+            data = compiled.to_representation(page.object_list)
+        return self.get_paginated_response(data)
+
+    def warn_db_render(self, compiled):
+        # e.g. the default "label" field, which calls __str__().  Use a
+        # serializer with add_label_fields = False to render in SQL.
+        warnings.warn(
+            "%s is registered with db_render=True, but its list is rendered "
+            "in Python because %s cannot be rendered in SQL"
+            % (self.model.__name__, compiled.json_unsupported),
+            RuntimeWarning,
+        )
+
+    def get_renderers(self):
+        if self.action == 'tiles':
+            return [MVTRenderer()]
+        return super(ModelViewSet, self).get_renderers()
+
+    def tiles(self, request, *args, **kwargs):
+        """
+        Render the (filtered) list as a Mapbox Vector Tile, for models
+        registered with map=True.
+        """
+        # Tile coordinates are not filters
+        z, x, y = (int(self.kwargs.pop(key)) for key in ('z', 'x', 'y'))
+        if not MIN_ZOOM <= z <= MAX_ZOOM:
+            raise Http404
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise Http404
+        queryset = self.filter_queryset(self.get_queryset())
+        if connections[queryset.db].vendor != 'postgresql':
+            raise Http404
+
+        tile = self.router.get_cached_tile(self.model, request)
+        if tile is None:
+            config = self.router.get_model_config(self.model) or {}
+            tile = render_tile(
+                queryset, z, x, y,
+                layer=config.get('name', self.model._meta.model_name),
+                lookup=self.lookup_field,
+                fields=config.get('tile_fields', None),
+            )
+            self.router.set_cached_tile(self.model, request, tile)
+        return Response(tile)
+
+    def changes(self, request, *args, **kwargs):
+        """
+        Incremental sync: return rows created or updated since the given
+        sync token, and ids of rows deleted since then.  Without a token,
+        only the current token is returned (clients should request it before
+        downloading the full list).
+
+        Changes are dated when they are saved, not when their transaction
+        commits, so changes newer than router.sync_lag seconds are held
+        back until any concurrent transactions are (assumed to be)
+        committed.  A transaction that takes longer than sync_lag to commit
+        may be missed by clients that synced in the meantime.
+        """
+        from .models import Change
+        ct = get_ct(self.model, for_concrete_model=True)
+        until = timezone.now() - timedelta(seconds=self.router.sync_lag)
+        since = request.GET.get('since', None)
+        if since is None:
+            latest = Change.objects.filter(
+                content_type=ct, date__lte=until
+            ).order_by('-date', '-pk').first()
+            return Response(OrderedDict([
+                ('sync_token', latest.sync_token if latest else '0'),
+                ('more', False),
+                ('list', []),
+                ('deleted', []),
+            ]))
+        try:
+            changes = Change.objects.since(since, until).filter(
+                content_type=ct
+            )
+        except (ValueError, OverflowError):
+            raise ValidationError({'since': 'Invalid sync token'})
+
+        paginator = self.paginator
+        limit = None
+        if paginator is not None and hasattr(paginator, 'get_page_size'):
+            limit = paginator.get_page_size(request)
+        limit = limit or api_settings.PAGE_SIZE or 50
+        changes = list(changes[:limit + 1])
+        more = len(changes) > limit
+        changes = changes[:limit]
+
+        pk_field = self.model._meta.pk
+        lookup = self.lookup_field
+        updated = [change.object_id for change in changes
+                   if not change.is_deleted]
+        deleted = [pk_field.to_python(change.object_id)
+                   if lookup in ('pk', pk_field.name)
+                   else change.deleted_id
+                   for change in changes if change.is_deleted]
+
+        # Serialize updated rows as they would appear in the list view
+        self.action = 'list'
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            pk__in=updated
+        )
+        data = self.get_serializer(queryset, many=True).data
+
+        # Rows that no longer match the (filtered) queryset are removed
+        found = set(queryset.values_list('pk', flat=True))
+        for obj in self.model.objects.filter(pk__in=updated).exclude(
+                pk__in=found):
+            deleted.append(get_object_id(obj))
+
+        return Response(OrderedDict([
+            ('sync_token', changes[-1].sync_token if changes else since),
+            ('more', more),
+            ('list', data),
+            ('deleted', deleted),
+        ]))
 
     def create(self, request, *args, **kwargs):
         response = super(ModelViewSet, self).create(
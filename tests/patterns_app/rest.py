@@ -2,6 +2,7 @@ from wq.db import rest
 from wq.db.patterns import rest as patterns
 from wq.db.patterns.identify.views import IdentifiedModelViewSet
 from wq.db.patterns.relate.views import RelatedModelViewSet
+from wq.db.patterns.locate.views import LocatedModelViewSet
 from .models import (
     AnnotatedModel, IdentifiedModel, MarkedModel, LocatedModel,
     RelatedModel, AnotherRelatedModel,
@@ -24,6 +25,10 @@ rest.router.register_model(
 rest.router.register_model(
     LocatedModel,
     serializer=patterns.LocatedModelSerializer,
+    viewset=LocatedModelViewSet,
+    sync=True,
+    map=True,
+    tile_fields=['name'],
 )
 rest.router.register_model(
     MarkedModel,
@@ -3,7 +3,9 @@ from .models import (
     RootModel, UserManagedModel, Parent, Child, ItemType, Item, GeometryModel,
     SlugModel, DateModel, ChoiceModel,
 )
-from .serializers import RootModelSerializer, ParentSerializer
+from .serializers import (
+    RootModelSerializer, ParentSerializer, GeometryModelSerializer,
+)
 
 rest.router.register_model(
     RootModel,
@@ -13,12 +15,16 @@ rest.router.register_model(
 )
 rest.router.register_model(UserManagedModel)
 rest.router.register_model(Parent, serializer=ParentSerializer)
-rest.router.register_model(Child, per_page=100, url="children")
-rest.router.register_model(ItemType)
-rest.router.register_model(Item)
-rest.router.register_model(GeometryModel)
+rest.router.register_model(
+    Child, per_page=100, url="children", cache=True
+)
+rest.router.register_model(ItemType, count="none")
+rest.router.register_model(Item, sync=True)
+rest.router.register_model(
+    GeometryModel, serializer=GeometryModelSerializer, db_render=True
+)
 rest.router.register_model(SlugModel, lookup="code")
-rest.router.register_model(DateModel)
+rest.router.register_model(DateModel, pagination="cursor", per_page=2)
 rest.router.register_model(ChoiceModel)
 rest.router.set_extra_config(debug=True)
 
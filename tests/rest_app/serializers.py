@@ -1,5 +1,5 @@
 from wq.db.rest.serializers import ModelSerializer
-from .models import OneToOneModel, ExtraModel, Child
+from .models import OneToOneModel, ExtraModel, Child, GeometryModel
 
 
 class RootModelSerializer(ModelSerializer):
@@ -15,3 +15,10 @@ class ChildSerializer(ModelSerializer):
 
 class ParentSerializer(ModelSerializer):
     children = ChildSerializer(many=True)
+
+
+class GeometryModelSerializer(ModelSerializer):
+    add_label_fields = False
+
+    class Meta:
+        model = GeometryModel
@@ -1,6 +1,8 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from tests.patterns_app.models import AnnotatedModel
 from wq.db.patterns.models import AnnotationType, Annotation
 
@@ -137,3 +139,21 @@ class AnnotateRestTestCase(APITestCase):
                 self.instance.annotations.get(type=atype).value,
                 '600'
             )
+
+    def test_annotate_list_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/annotatedmodels.json')
+            self.assertTrue(status.is_success(response.status_code))
+            return len(queries)
+
+        num_queries = count_queries()
+        for i in range(3):
+            instance = AnnotatedModel.objects.create(name="Test %s" % i)
+            instance.vals = {
+                'Width': i,
+                'Height': i,
+            }
+
+        # Annotations and their types are prefetched
+        self.assertEqual(count_queries(), num_queries)
@@ -28,6 +28,19 @@ class AuthTestCase(APITestCase):
         self.assertEqual(account['label'], "testuser@example.com")
         self.assertEqual(account['provider_label'], 'Google')
 
+    def test_auth_login_config_hash(self):
+        response = self.client.get('/login.json')
+        result = json.loads(response.content.decode('utf-8'))
+        self.assertIn("config", result)
+        self.assertIn("config_hash", result)
+
+        response = self.client.get(
+            '/login.json?config_hash=' + result['config_hash']
+        )
+        cached = json.loads(response.content.decode('utf-8'))
+        self.assertNotIn("config", cached)
+        self.assertEqual(cached['config_hash'], result['config_hash'])
+
     def test_auth_context_processors(self):
         response = self.client.get('/auth_context')
         result = response.content.decode('utf-8')
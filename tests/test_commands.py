@@ -5,6 +5,8 @@ try:
 except ImportError:
     from io import StringIO
 import json
+import tempfile
+import warnings
 
 
 class CommandTestCase(APITestCase):
@@ -32,3 +34,189 @@ class CommandTestCase(APITestCase):
         text = text.replace('define(', '')
         text = text.replace(');', '')
         self.check_config(text)
+
+    def test_dump_config_compiled(self):
+        from wq.db import rest
+        f = StringIO()
+        call_command('dump_config', format='compiled', stdout=f)
+        data = json.loads(f.getvalue())
+        self.assertEqual(data['version'], 1)
+        self.assertEqual(
+            data['fingerprint'], rest.router.get_config_fingerprint()
+        )
+        self.check_config(json.dumps(data['config']))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write(json.dumps(data))
+            f.flush()
+            rest.router.load_compiled_config(f.name)
+        try:
+            self.assertEqual(
+                rest.router.base_config['pages'].keys(),
+                data['config']['pages'].keys(),
+            )
+            self.assertIsNotNone(rest.router._compiled_config)
+        finally:
+            rest.router._compiled_config = None
+            rest.router._base_config = None
+
+    def test_dump_config_compiled_field_change(self):
+        from wq.db import rest
+        from tests.rest_app.models import ChoiceModel
+        f = StringIO()
+        call_command('dump_config', format='compiled', stdout=f)
+        data = json.loads(f.getvalue())
+
+        field = ChoiceModel._meta.get_field('choice')
+        verbose_name = field.verbose_name
+        field.verbose_name = "Changed Choice"
+        try:
+            self.assertNotEqual(
+                data['fingerprint'], rest.router.get_config_fingerprint()
+            )
+            with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+                f.write(json.dumps(data))
+                f.flush()
+                rest.router.load_compiled_config(f.name)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                config = rest.router.base_config
+            self.assertEqual(len(caught), 1)
+            self.assertIn("out of date", str(caught[0].message))
+            self.assertIsNone(rest.router._compiled_config)
+            form = config['pages']['choicemodel']['form']
+            self.assertEqual(form[1]['label'], "Changed Choice")
+        finally:
+            field.verbose_name = verbose_name
+            rest.router._compiled_config = None
+            rest.router._base_config = None
+
+    def test_dump_config_compiled_serializer_change(self):
+        from wq.db import rest
+        from rest_framework import serializers
+        from tests.rest_app.serializers import GeometryModelSerializer
+        fingerprint = rest.router.get_config_fingerprint()
+
+        GeometryModelSerializer.Meta.exclude = ('name',)
+        try:
+            self.assertNotEqual(
+                fingerprint, rest.router.get_config_fingerprint()
+            )
+        finally:
+            del GeometryModelSerializer.Meta.exclude
+        self.assertEqual(fingerprint, rest.router.get_config_fingerprint())
+
+        declared = GeometryModelSerializer._declared_fields
+        declared['extra'] = serializers.CharField(label="Extra")
+        try:
+            self.assertNotEqual(
+                fingerprint, rest.router.get_config_fingerprint()
+            )
+        finally:
+            del declared['extra']
+        self.assertEqual(fingerprint, rest.router.get_config_fingerprint())
+
+    def test_import_locations(self):
+        from wq.db import rest
+        from tests.patterns_app.models import LocatedModel
+        from wq.db.patterns.models import Location, PrimaryLocation
+        objs = [
+            LocatedModel.objects.create(name="Site %s" % i) for i in range(3)
+        ]
+        features = [{
+            'type': 'Feature',
+            'id': obj.pk,
+            'properties': {'name': 'Location %s' % i},
+            'geometry': {
+                'type': 'Point',
+                # Web mercator coordinates for (-93 + i, 45)
+                'coordinates': [
+                    (-93 + i) * 20037508.342789244 / 180,
+                    5621521.486192066,
+                ],
+            },
+        } for i, obj in enumerate(objs)]
+        features.append(dict(features[0], id=999999))
+        data = {
+            'type': 'FeatureCollection',
+            'crs': {
+                'type': 'name',
+                'properties': {'name': 'urn:ogc:def:crs:EPSG::3857'},
+            },
+            'features': features,
+        }
+
+        f = StringIO()
+        rest.router.update_config(LocatedModel, primary_location=True)
+        try:
+            with tempfile.NamedTemporaryFile(
+                    'w', suffix='.geojson') as geojson:
+                geojson.write(json.dumps(data))
+                geojson.flush()
+                call_command(
+                    'import_locations', 'patterns_app.LocatedModel',
+                    geojson.name, batch_size=2, offset=1, stdout=f,
+                )
+        finally:
+            rest.router.update_config(LocatedModel, primary_location=None)
+        self.assertIn(
+            "4 features read, 2 locations created, 1 unmatched",
+            f.getvalue(),
+        )
+
+        # First feature was skipped with offset=1
+        self.assertFalse(Location.objects.filter(object_id=objs[0].pk))
+        loc = Location.objects.get(object_id=objs[1].pk)
+        self.assertEqual(loc.name, 'Location 1')
+        self.assertEqual(loc.geometry.srid, 4326)
+        self.assertAlmostEqual(loc.geometry.x, -92, places=5)
+        self.assertAlmostEqual(loc.geometry.y, 45, places=5)
+        self.assertTrue(
+            PrimaryLocation.objects.filter(object_id=objs[2].pk).exists()
+        )
+
+    def test_import_locations_malformed(self):
+        from wq.db.patterns.locate.geojson import FeatureReader
+        feature = json.dumps({
+            'type': 'Feature',
+            'id': 1,
+            'geometry': {'type': 'Point', 'coordinates': [-93, 45]},
+        })
+        features = ['{"type": "Feature" "id": 0}'] + [feature] * 1000
+        stream = StringIO(
+            '{"type": "FeatureCollection", "features": [%s]}'
+            % ', '.join(features)
+        )
+        reader = FeatureReader(stream, chunk_size=100, max_value_size=1000)
+        with self.assertRaises(ValueError):
+            list(reader)
+        # Stopped reading soon after the malformed feature
+        self.assertLess(stream.tell(), 2000)
+
+    def test_import_locations_large_feature(self):
+        from wq.db.patterns.locate.geojson import FeatureReader
+        feature = {
+            'type': 'Feature',
+            'id': 1,
+            'properties': {'name': 'Escaped \\"}] characters'},
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': [[-93 + i / 1000.0, 45] for i in range(2000)],
+            },
+        }
+        stream = StringIO(json.dumps({
+            'type': 'FeatureCollection',
+            'features': [feature, feature],
+        }))
+        calls = []
+
+        class Decoder(json.JSONDecoder):
+            def raw_decode(self, text, pos=0):
+                calls.append(pos)
+                return super(Decoder, self).raw_decode(text, pos)
+
+        reader = FeatureReader(stream, chunk_size=100)
+        reader.decoder = Decoder()
+        self.assertEqual(list(reader), [feature, feature])
+        # Each feature is decoded once, after its end has been found
+        self.assertLess(len(calls), 10)
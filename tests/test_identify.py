@@ -29,6 +29,24 @@ class IdentifyTestCase(APITestCase):
         instance2 = IdentifiedModel.objects.find("Test 1")
         self.assertEqual(instance, instance2)
 
+    def test_identify_batch_lookup(self):
+        instance1 = IdentifiedModel.objects.find("Test 1")
+        instance2 = IdentifiedModel.objects.find("Test 2")
+        instance2.identifiers.create(
+            authority=self.auth,
+            name="Other Name",
+            slug="other-slug",
+        )
+        with self.assertNumQueries(4):
+            matches = IdentifiedModel.objects.get_pks_by_identifiers([
+                "test-1", "Test 2", "other-slug", "Missing",
+            ])
+        self.assertEqual(matches, {
+            "test-1": instance1.pk,
+            "Test 2": instance2.pk,
+            "other-slug": instance2.pk,
+        })
+
     def test_identify_auth_url(self):
         instance = IdentifiedModel.objects.find("Test 2")
         instance.identifiers.create(
@@ -1,8 +1,10 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from tests.patterns_app.models import LocatedModel
-from wq.db.patterns.models import Location
+from wq.db.patterns.models import Location, PrimaryLocation
 import json
 
 
@@ -172,6 +174,48 @@ class LocateRestTestCase(APITestCase):
         data = json.loads(response.content.decode('utf-8'))
         self.assertEqual(expected, data)
 
+    def test_locate_list_geojson_stream(self):
+        from wq.db import rest
+        for i in range(4):
+            instance = LocatedModel.objects.create(name="Test %s" % (i + 2))
+            instance.locations.create(geometry='POINT(-9%s 45)' % i)
+        url = '/locatedmodels.geojson?limit=1000'
+        expected = json.loads(
+            self.client.get(url).content.decode('utf-8')
+        )
+
+        # (Normally enabled with stream_geojson=True in register_model())
+        viewset = rest.router.get_viewset_for_model(LocatedModel)
+        viewset.stream_geojson = True
+        viewset.stream_chunk_size = 2
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                self.assertTrue(response.streaming)
+                content = b''.join(response.streaming_content)
+        finally:
+            del viewset.stream_geojson
+            del viewset.stream_chunk_size
+        data = json.loads(content.decode('utf-8'))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['features']), 5)
+        for result in data, expected:
+            result['features'].sort(key=lambda feature: feature['id'])
+        self.assertEqual(data, expected)
+        for feature in data['features']:
+            self.assertEqual(feature['geometry']['type'], 'GeometryCollection')
+            self.assertTrue(feature['geometry']['geometries'])
+
+        # Rows are loaded in chunks of 2 (by primary key)
+        chunk_queries = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "patterns_app_locatedmodel"' in query['sql'] and
+            '"id" IN (' in query['sql']
+        ]
+        self.assertEqual(len(chunk_queries), 3)
+
     def test_locate_detail_geojson(self):
         pk = self.instance.pk
         loc1 = self.instance.locations.all()[0]
@@ -256,3 +300,233 @@ class LocateRestTestCase(APITestCase):
         response = self.client.get('/locatedmodels/%s/edit.geojson' % pk)
         data = json.loads(response.content.decode('utf-8'))
         self.assertEqual(expected, data)
+
+    def test_locate_changes(self):
+        """
+        Adding a location should count as a change to the parent object
+        """
+        response = self.client.get('/locatedmodels/changes.json')
+        token = response.data['sync_token']
+        self.instance.locations.create(geometry='POINT(-92 44)')
+        response = self.client.get(
+            '/locatedmodels/changes.json?since=' + token
+        )
+        self.assertEqual(len(response.data['list']), 1)
+        self.assertEqual(response.data['list'][0]['id'], self.instance.pk)
+
+    def test_locate_tiles(self):
+        """
+        Mapped models should be available as (cached) vector tiles
+        """
+        response = self.client.get('/locatedmodels/tiles/0/0/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response['Content-Type'], 'application/vnd.mapbox-vector-tile'
+        )
+        tile = response.content
+        self.assertTrue(tile)
+        self.assertIn(b'Test 1', tile)
+
+        response = self.client.get('/locatedmodels/tiles/0/0/0.mvt')
+        self.assertEqual(response.content, tile)
+
+        # Saving a location should invalidate the cached tile
+        self.instance.locations.create(geometry='POINT(10 10)')
+        response = self.client.get('/locatedmodels/tiles/0/0/0.mvt')
+        self.assertNotEqual(response.content, tile)
+
+        # Tile outside of z/x/y range
+        response = self.client.get('/locatedmodels/tiles/1/2/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/locatedmodels/tiles/5000/0/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_locate_spatial_filters(self):
+        other = LocatedModel.objects.create(name="Test 2")
+        other.locations.create(geometry='POINT(10 10)')
+
+        def names(**params):
+            response = self.client.get('/locatedmodels.json', params)
+            self.assertEqual(
+                response.status_code, status.HTTP_200_OK, response.data
+            )
+            return sorted(item['name'] for item in response.data['list'])
+
+        self.assertEqual(names(bbox='-92,45,-90,47'), ['Test 1'])
+        self.assertEqual(names(bbox='0,0,20,20'), ['Test 2'])
+        self.assertEqual(names(bbox='-100,0,20,50'), ['Test 1', 'Test 2'])
+        self.assertEqual(names(bbox='-100,-50,-99,-49'), [])
+        self.assertEqual(names(intersects=json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[9, 9], [11, 9], [11, 11], [9, 11], [9, 9]]],
+        })), ['Test 2'])
+        self.assertEqual(names(dwithin='-96,45.5,1'), ['Test 1'])
+
+        response = self.client.get('/locatedmodels.json?bbox=1,2,3')
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_locate_cluster(self):
+        other = LocatedModel.objects.create(name="Test 2")
+        other.locations.create(geometry='POINT(-92 44)')
+        distant = LocatedModel.objects.create(name="Test 3")
+        distant.locations.create(geometry='POINT(10 10)')
+
+        response = self.client.get('/locatedmodels.json?cluster=0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        clusters = sorted(response.data['list'], key=lambda c: c['count'])
+        self.assertEqual([c['count'] for c in clusters], [1, 2])
+        self.assertEqual(clusters[0]['id'], distant.pk)
+        self.assertAlmostEqual(clusters[0]['longitude'], 10)
+        self.assertAlmostEqual(clusters[0]['latitude'], 10)
+
+        response = self.client.get(
+            '/locatedmodels.json?cluster=2&bbox=-100,40,-80,50'
+        )
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['list']), 1)
+
+        # Cached per tile, but invalidated when locations change
+        distant.locations.create(geometry='POINT(-93 45)')
+        response = self.client.get(
+            '/locatedmodels.json?cluster=2&bbox=-100,40,-80,50'
+        )
+        self.assertEqual(response.data['count'], 3)
+
+        response = self.client.get('/locatedmodels.json?cluster=20')
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_locate_near(self):
+        for i in range(4):
+            instance = LocatedModel.objects.create(name="Test %s" % (i + 2))
+            instance.locations.create(geometry='POINT(-%s 40)' % (80 + i))
+
+        response = self.client.get(
+            '/locatedmodels.json?near=-83.2,40&limit=2'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        items = response.data['list']
+        self.assertEqual(
+            [item['name'] for item in items], ['Test 5', 'Test 4']
+        )
+        self.assertLess(items[0]['distance'], items[1]['distance'])
+        self.assertAlmostEqual(items[0]['distance'], 17000, delta=1000)
+
+        # The paginator (not the filter) limits the results
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(response.data['pages'], 3)
+        response = self.client.get(
+            '/locatedmodels.json?near=-83.2,40&limit=2&page=2'
+        )
+        self.assertEqual(
+            [item['name'] for item in response.data['list']],
+            ['Test 3', 'Test 2']
+        )
+
+        # Objects with several locations are only listed once
+        response = self.client.get(
+            '/locatedmodels.json?near=-93,45.5&limit=3'
+        )
+        self.assertEqual(
+            [item['name'] for item in response.data['list']],
+            ['Test 1', 'Test 5', 'Test 4']
+        )
+
+        # Filters still apply
+        response = self.client.get(
+            '/locatedmodels.json?near=-83.2,40&limit=2&bbox=-81.5,39,-79,41'
+        )
+        self.assertEqual(
+            [item['name'] for item in response.data['list']],
+            ['Test 3', 'Test 2']
+        )
+
+    def test_locate_near_geography(self):
+        """
+        Rows should be ordered by distance on the earth, not in degrees.
+        """
+        east = LocatedModel.objects.create(name="East")
+        east.locations.create(geometry='POINT(1 60)')
+        north = LocatedModel.objects.create(name="North")
+        north.locations.create(geometry='POINT(0 60.8)')
+
+        # At 60N, 1 degree east (~56km) is closer than 0.8 degrees north
+        # (~89km), even though it is farther in degrees
+        response = self.client.get('/locatedmodels.json?near=0,60&limit=2')
+        items = response.data['list']
+        self.assertEqual([item['name'] for item in items], ['East', 'North'])
+        self.assertAlmostEqual(items[0]['distance'], 55800, delta=1000)
+
+    def test_locate_primary_location(self):
+        """
+        PrimaryLocation should track each object's primary (or first)
+        location, and can be used for GeoJSON lists.
+        """
+        from wq.db import rest
+
+        # Not tracked unless the model opts in
+        self.assertFalse(PrimaryLocation.objects.exists())
+
+        def primary():
+            return PrimaryLocation.objects.get(
+                object_id=self.instance.pk
+            ).geometry
+
+        rest.router.update_config(LocatedModel, primary_location=True)
+        try:
+            loc = self.instance.locations.get(geometry='POINT(-91 46)')
+            loc.save()
+            self.assertEqual(primary().coords, (-91, 46))
+            loc = self.instance.locations.get(geometry='POINT(-96 45)')
+            loc.is_primary = True
+            loc.save()
+            self.assertEqual(primary().coords, (-96, 45))
+
+            response = self.client.get('/locatedmodels.geojson')
+            data = json.loads(response.content.decode('utf-8'))
+            self.assertEqual(len(data['features']), 1)
+            self.assertEqual(data['features'][0]['geometry'], {
+                'type': 'Point',
+                'coordinates': [-96, 45],
+            })
+
+            self.instance.locations.all().delete()
+            self.assertFalse(PrimaryLocation.objects.filter(
+                object_id=self.instance.pk
+            ).exists())
+        finally:
+            rest.router.update_config(LocatedModel, primary_location=None)
+
+    def test_locate_primary_location_reparent(self):
+        """
+        Moving a location to another object should update the
+        PrimaryLocation of both objects.
+        """
+        from wq.db import rest
+        rest.router.update_config(LocatedModel, primary_location=True)
+        try:
+            self.check_primary_location_reparent()
+        finally:
+            rest.router.update_config(LocatedModel, primary_location=None)
+
+    def check_primary_location_reparent(self):
+        other = LocatedModel.objects.create(name="Test 2")
+
+        def primary(obj):
+            return PrimaryLocation.objects.filter(object_id=obj.pk).first()
+
+        loc = self.instance.locations.get(geometry='POINT(-91 46)')
+        loc.object_id = other.pk
+        loc.save()
+        self.assertEqual(primary(other).geometry.coords, (-91, 46))
+        self.assertEqual(primary(self.instance).geometry.coords, (-96, 45))
+
+        loc = self.instance.locations.get()
+        loc.object_id = other.pk
+        loc.save()
+        self.assertIsNone(primary(self.instance))
+        self.assertEqual(primary(other).geometry.coords, (-91, 46))
@@ -3,10 +3,15 @@ from rest_framework import status
 import json
 from tests.rest_app.models import (
     RootModel, OneToOneModel, ForeignKeyModel, ExtraModel, UserManagedModel,
-    Parent, ItemType, GeometryModel, SlugModel, DateModel, ChoiceModel,
+    Parent, Child, ItemType, GeometryModel, SlugModel, DateModel,
+    ChoiceModel, Item,
 )
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models.functions import Lower
+from django.test.utils import CaptureQueriesContext
 
 
 class RestTestCase(APITestCase):
@@ -65,6 +70,26 @@ class RestTestCase(APITestCase):
         # Extra config
         self.assertIn("debug", result)
 
+    def test_rest_config_json_etag(self):
+        response = self.client.get('/config.json')
+        self.assertIn('ETag', response)
+        etag = response['ETag']
+
+        response = self.client.get('/config.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/config.json', HTTP_IF_NONE_MATCH='"0"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Config varies by user permissions
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_superuser=True)
+        )
+        response = self.client.get('/config.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_rest_index_json(self):
         from wq.db.rest import router
         result = router.get_index(self.user)
@@ -221,6 +246,312 @@ class RestTestCase(APITestCase):
             self.assertIn("list", response.data[listurl])
             self.assertGreater(len(response.data[listurl]["list"]), 0)
 
+    def test_rest_multi_concurrent(self):
+        from wq.db import rest
+        lists = ['usermanagedmodels', 'items', 'children']
+        rest.router.multi_workers = 2
+        try:
+            response = self.client.get(
+                "/multi.json?lists=" + ",".join(lists)
+            )
+        finally:
+            rest.router.multi_workers = 1
+            rest.router.get_multi_executor().shutdown()
+            rest.router._multi_executor = None
+        self.assertTrue(status.is_success(response.status_code))
+        for listurl in lists:
+            self.assertIn(listurl, response.data)
+            # Worker threads have their own connections (and transactions)
+            self.assertIn("list", response.data[listurl])
+
+    def test_rest_multi_errors(self):
+        from wq.db import rest
+        lists = ['usermanagedmodels', 'items']
+        paginate = rest.router.paginate
+
+        def broken_paginate(model, page_num, request):
+            if model == Item:
+                raise Exception("SECRET SQL ERROR")
+            return paginate(model, page_num, request)
+
+        rest.router.paginate = broken_paginate
+        try:
+            for workers in 1, 2:
+                rest.router.multi_workers = workers
+                response = self.client.get(
+                    "/multi.json?lists=" + ",".join(lists)
+                )
+                self.assertTrue(status.is_success(response.status_code))
+                self.assertIn("list", response.data['usermanagedmodels'])
+                self.assertEqual(
+                    response.data['items'], {'error': 'Could not load list'}
+                )
+        finally:
+            del rest.router.paginate
+            rest.router.multi_workers = 1
+            rest.router.get_multi_executor().shutdown()
+            rest.router._multi_executor = None
+
+    def test_rest_multi_reuses_views(self):
+        from wq.db import rest
+        lists = [
+            conf['url'] for conf in rest.router.get_config()['pages'].values()
+            if conf.get('list') and conf['url']
+        ]
+        self.assertGreater(len(lists), 20)
+        self.client.get("/multi.json?lists=" + ",".join(lists))
+        viewset = rest.router.get_viewset_for_model(Parent)
+        view = rest.router.get_list_view_for_model(Parent)
+
+        response = self.client.get("/multi.json?lists=" + ",".join(lists))
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertIn('parents', response.data)
+        self.assertIs(viewset, rest.router.get_viewset_for_model(Parent))
+        self.assertIs(view, rest.router.get_list_view_for_model(Parent))
+
+    def test_rest_cache(self):
+        response = self.client.get('/parents/1/children.json')
+        self.assertEqual(response.data['list'][0]['parent_label'], "Test")
+        name = response.data['list'][0]['label']
+
+        # Bulk updates don't send signals, so the cached version is returned
+        Child.objects.update(name="Updated")
+        response = self.client.get('/parents/1/children.json')
+        self.assertEqual(response.data['list'][0]['label'], name)
+
+        # Saving a model in the output invalidates the cache
+        parent = Parent.objects.get(pk=1)
+        parent.name = "Parent"
+        parent.save()
+        response = self.client.get('/parents/1/children.json')
+        self.assertEqual(response.data['list'][0]['parent_label'], "Parent")
+        self.assertEqual(response.data['list'][0]['label'], "Updated")
+
+    def test_rest_cache_object_permissions(self):
+        from wq.db import rest
+        from rest_framework.permissions import BasePermission
+
+        class ObjectPermission(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.name != "Test 2"
+
+        denied = Child.objects.get(name="Test 2")
+        allowed = Child.objects.filter(name="Test 1").first()
+        for child in denied, allowed:
+            response = self.client.get('/children/%s.json' % child.pk)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Cached responses are not returned without the permission check
+        viewset = rest.router.get_viewset_for_model(Child)
+        permission_classes = viewset.permission_classes
+        viewset.permission_classes = [ObjectPermission]
+        try:
+            response = self.client.get('/children/%s.json' % denied.pk)
+            self.assertEqual(
+                response.status_code, status.HTTP_403_FORBIDDEN
+            )
+            response = self.client.get('/children/%s.json' % allowed.pk)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['label'], "Test 1")
+        finally:
+            viewset.permission_classes = permission_classes
+
+    def test_rest_cache_host(self):
+        parent = Parent.objects.get(pk=1)
+        Child.objects.bulk_create([
+            Child(parent=parent, name="Child %s" % i) for i in range(100)
+        ])
+        with self.settings(ALLOWED_HOSTS=['*']):
+            for host in 'a.example.com', 'b.example.com':
+                response = self.client.get('/children.json', HTTP_HOST=host)
+                self.assertTrue(
+                    response.data['next'].startswith('http://%s/' % host)
+                )
+
+    def test_rest_changes(self):
+        from wq.db import rest
+        rest.router.sync_lag = 0
+        try:
+            self.check_changes()
+        finally:
+            rest.router.sync_lag = 5
+
+    def check_changes(self):
+        response = self.client.get('/items/changes.json')
+        self.assertTrue(status.is_success(response.status_code))
+        token = response.data['sync_token']
+        self.assertEqual(response.data['list'], [])
+
+        itype = ItemType.objects.get(pk=1)
+        new_item = itype.item_set.create(name="Test 3")
+        item1, item2 = itype.item_set.exclude(pk=new_item.pk).order_by('pk')
+        item1.name = "Updated"
+        with CaptureQueriesContext(connection) as queries:
+            item1.save()
+        # One query for the item and one to update its existing change
+        self.assertEqual(len(queries), 2)
+        item2_id = item2.pk
+        item2.delete()
+
+        response = self.client.get('/items/changes.json?since=' + token)
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertFalse(response.data['more'])
+        self.assertEqual(
+            sorted(item['label'] for item in response.data['list']),
+            ["Test 3", "Updated"]
+        )
+        self.assertEqual(response.data['deleted'], [item2_id])
+
+        token = response.data['sync_token']
+        response = self.client.get('/items/changes.json?since=' + token)
+        self.assertEqual(response.data['sync_token'], token)
+        self.assertEqual(response.data['list'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_rest_changes_lag(self):
+        from wq.db import rest
+        from wq.db.rest.models import Change
+        response = self.client.get('/items/changes.json?since=0')
+        self.assertTrue(status.is_success(response.status_code))
+        # Items created in setUp are within the sync_lag window
+        self.assertEqual(response.data['sync_token'], '0')
+        self.assertEqual(response.data['list'], [])
+
+        rest.router.sync_lag = 0
+        try:
+            response = self.client.get('/items/changes.json?since=0')
+        finally:
+            rest.router.sync_lag = 5
+        self.assertEqual(len(response.data['list']), Item.objects.count())
+        self.assertNotEqual(response.data['sync_token'], '0')
+
+        # Changes are stored by object id as text
+        ct = ContentType.objects.get_for_model(Item)
+        Change.objects.set_change(ct.pk, 'text-id')
+        self.assertTrue(Change.objects.filter(object_id='text-id').exists())
+
+        for token in 'invalid', '1.x', '9' * 30 + '.1':
+            response = self.client.get('/items/changes.json?since=' + token)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+        # Views without pagination use the default page size
+        viewset = rest.router.get_viewset_for_model(Item)
+        pagination_class = viewset.pagination_class
+        viewset.pagination_class = None
+        try:
+            response = self.client.get('/items/changes.json?since=0')
+        finally:
+            viewset.pagination_class = pagination_class
+        self.assertTrue(status.is_success(response.status_code))
+
+    def test_rest_list_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/items.json')
+            self.assertEqual(len(response.data['list']), Item.objects.count())
+            return len(queries)
+
+        num_queries = count_queries()
+        for i in range(5):
+            itype = ItemType.objects.create(name="Type %s" % i)
+            itype.item_set.create(name="Item %s" % i)
+
+        # Item types are loaded with select_related()
+        self.assertEqual(count_queries(), num_queries)
+
+    def test_rest_compiled_list(self):
+        from wq.db import rest
+        ExtraModel.objects.create(
+            root=RootModel.objects.get(slug='instance'),
+            alt_root=RootModel.objects.create(slug='alt', description="Alt"),
+        )
+        DateModel.objects.create(name="Empty", date="2015-01-02")
+        for model in (ExtraModel, UserManagedModel, Child, Item, SlugModel,
+                      DateModel, ChoiceModel):
+            serializer_class = rest.router.get_serializer_for_model(model)
+            compiled = serializer_class().compile_list()
+            self.assertIsNotNone(compiled, model)
+            queryset = model.objects.order_by('pk')
+            self.assertEqual(
+                compiled.to_representation(compiled.get_queryset(queryset)),
+                serializer_class(queryset, many=True).data,
+            )
+
+        # Nested and geometry fields use the regular serializer
+        for model in (RootModel, GeometryModel):
+            serializer_class = rest.router.get_serializer_for_model(model)
+            self.assertIsNone(serializer_class().compile_list())
+
+    def test_rest_db_render(self):
+        from wq.db import rest
+        from wq.db.rest.renderers import JSONRenderer, GeoJSONRenderer
+        for i in range(3):
+            GeometryModel.objects.create(
+                name="Geometry %s" % i,
+                geometry="POINT(%s 45.5)" % (-93 - i),
+            )
+        serializer_class = rest.router.get_serializer_for_model(GeometryModel)
+        expected = serializer_class(
+            GeometryModel.objects.order_by('pk'), many=True
+        ).data
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/geometrymodels.json')
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertTrue(any(
+            'json_agg' in query['sql'] for query in queries.captured_queries
+        ))
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['count'], 3)
+        # (The list view is unordered)
+        self.assertEqual(
+            sorted(data['list'], key=lambda obj: obj['id']),
+            json.loads(JSONRenderer().render(expected).decode('utf-8')),
+        )
+
+        # json_agg() output follows the queryset ordering
+        compiled = serializer_class().compile_list(allow_geometry=True)
+        for ordering in ('-name', 'name', '-pk'):
+            queryset = GeometryModel.objects.order_by(ordering)
+            data = compiled.render_json(compiled.get_queryset(queryset))
+            self.assertEqual(
+                [obj['name'] for obj in json.loads(data.json)],
+                list(queryset.values_list('name', flat=True)),
+            )
+            self.assertEqual(
+                json.loads(data.json)[0]['name'],
+                "Geometry 0" if ordering == 'name' else "Geometry 2",
+            )
+
+        # Ordering by expressions that are not in the output is not supported
+        queryset = compiled.get_queryset(
+            GeometryModel.objects.order_by(Lower('name'))
+        )
+        self.assertFalse(compiled.can_render_json(queryset))
+        self.assertEqual(compiled.json_unsupported, "its ordering")
+
+        response = self.client.get('/geometrymodels.geojson')
+        self.assertTrue(status.is_success(response.status_code))
+        data = json.loads(response.content.decode('utf-8'))
+        expected = json.loads(
+            GeoJSONRenderer().render(list(expected)).decode('utf-8')
+        )
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(
+            sorted(data['features'], key=lambda obj: obj['id']),
+            expected['features'],
+        )
+
+    def test_rest_db_render_unsupported(self):
+        from wq.db import rest
+        # The default label field calls __str__() and is rendered in Python
+        serializer_class = rest.router.get_serializer_for_model(Item)
+        compiled = serializer_class().compile_list(allow_geometry=True)
+        self.assertIsNone(compiled.get_json_expressions())
+        self.assertEqual(compiled.json_unsupported, "the 'label' field")
+
     def test_rest_custom_lookup(self):
         response = self.client.get('/slugmodels/test.json')
         self.assertTrue(status.is_success(response.status_code), response.data)
@@ -241,6 +572,91 @@ class RestTestCase(APITestCase):
         self.assertTrue(status.is_success(response.status_code), response.data)
         self.assertEqual(response.data['per_page'], 10)
 
+    def test_rest_cursor_pagination(self):
+        for i in range(3):
+            DateModel.objects.create(name="Test %s" % i, date="2015-01-02")
+        response = self.client.get('/datemodels.json')
+        self.assertTrue(status.is_success(response.status_code), response.data)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(response.data['page'], 1)
+        self.assertTrue(response.data['multiple'])
+        self.assertIsNone(response.data['previous'])
+        self.assertEqual(
+            [obj['name'] for obj in response.data['list']],
+            ["Test 2", "Test 1"]
+        )
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['page'], 2)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+        self.assertEqual(
+            [obj['name'] for obj in response.data['list']],
+            ["Test 0", "Test"]
+        )
+
+    def test_rest_count_none(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/itemtypes.json')
+        self.assertTrue(status.is_success(response.status_code), response.data)
+        self.assertIsNone(response.data['count'])
+        self.assertIsNone(response.data['pages'])
+        self.assertFalse(response.data['multiple'])
+        self.assertEqual(len(response.data['list']), 1)
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'].upper())
+
+        ItemType.objects.create(name="Test 2")
+        response = self.client.get('/itemtypes.json?limit=1')
+        self.assertTrue(response.data['multiple'])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['page'], 2)
+        self.assertIsNone(response.data['next'])
+        response = self.client.get('/itemtypes.json?limit=1&page=3')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rest_count_cached(self):
+        from wq.db.rest.pagination import Paginator
+        paginator = Paginator(Child.objects.all(), 10, count_mode='cached')
+        self.assertEqual(paginator.count, 3)
+        Child.objects.create(name="Test 3", parent_id=1)
+
+        # Same filter signature: cached count is reused until it expires
+        paginator = Paginator(Child.objects.all(), 10, count_mode='cached')
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 3)
+
+        # Different filter signature
+        paginator = Paginator(
+            Child.objects.filter(parent_id=1), 10, count_mode='cached'
+        )
+        self.assertEqual(paginator.count, 3)
+
+        # Cache keys include the model
+        self.assertIn(
+            'rest_app.child',
+            Paginator(Child.objects.all(), 10).get_count_cache_key(),
+        )
+
+    def test_rest_count_estimate(self):
+        from wq.db.rest.pagination import Paginator
+
+        # Small result sets fall back to an exact count
+        paginator = Paginator(Child.objects.all(), 2, count_mode='estimate')
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+
+        paginator = Paginator(
+            Child.objects.filter(parent_id=1), 1,
+            count_mode='estimate', count_threshold=0,
+        )
+        self.assertIsNotNone(paginator.count)
+        self.assertFalse(paginator.count_is_exact)
+        page = paginator.page(2)
+        self.assertEqual(len(page), 1)
+        self.assertFalse(page.has_next())
+
     def test_rest_date_label(self):
         response = self.client.get("/datemodels/1.json")
         self.assertTrue(status.is_success(response.status_code), response.data)
@@ -257,11 +673,11 @@ class RestTestCase(APITestCase):
 class RestRouterTestCase(APITestCase):
     def test_rest_model_conflict(self):
         from wq.db import rest
-        from tests.conflict_app.models import Item
+        from tests.conflict_app.models import Item as ConflictItem
 
         # Register model with same name as existing model
         with self.assertRaises(ImproperlyConfigured) as e:
-            rest.router.register_model(Item)
+            rest.router.register_model(ConflictItem)
         self.assertEqual(
             e.exception.args[0],
             "Could not register <class 'tests.conflict_app.models.Item'>: "
@@ -271,7 +687,7 @@ class RestRouterTestCase(APITestCase):
 
         # Register model with different name, but same URL as existing model
         with self.assertRaises(ImproperlyConfigured) as e:
-            rest.router.register_model(Item, name="conflictitem")
+            rest.router.register_model(ConflictItem, name="conflictitem")
         self.assertEqual(
             e.exception.args[0],
             "Could not register <class 'tests.conflict_app.models.Item'>: "
@@ -281,10 +697,89 @@ class RestRouterTestCase(APITestCase):
 
         # Register model with different name and URL
         rest.router.register_model(
-            Item, name="conflictitem", url="conflictitems"
+            ConflictItem, name="conflictitem", url="conflictitems"
         )
         self.assertIn("conflictitem", rest.router.get_config()['pages'])
 
+    def test_rest_serializer_cache(self):
+        from wq.db import rest
+        rest.router.update_config(RootModel)
+        info = rest.router.serializer_cache_info()
+        self.assertEqual(info['size'], 0)
+
+        serializer = rest.router.get_serializer_for_model(RootModel, 0)
+        self.assertIs(
+            serializer, rest.router.get_serializer_for_model(RootModel, 0)
+        )
+        self.assertIsNot(
+            serializer, rest.router.get_serializer_for_model(RootModel, 1)
+        )
+        self.assertEqual(serializer.Meta.wq_config['lookup'], 'slug')
+
+        new_info = rest.router.serializer_cache_info()
+        self.assertEqual(new_info['hits'], info['hits'] + 1)
+        self.assertEqual(new_info['misses'], info['misses'] + 2)
+
+        rest.router.update_config(RootModel)
+        self.assertIsNot(
+            serializer, rest.router.get_serializer_for_model(RootModel, 0)
+        )
+
+        # Re-registering a serializer should also rebuild the viewset
+        viewset = rest.router.get_viewset_for_model(Parent)
+        self.assertEqual(viewset.lookup_field, 'pk')
+        original = rest.router._serializers[Parent]
+
+        class NewSerializer(original):
+            class Meta:
+                wq_config = {'lookup': 'name'}
+
+        rest.router.register_serializer(Parent, NewSerializer)
+        try:
+            self.assertEqual(
+                rest.router.get_viewset_for_model(Parent).lookup_field,
+                'name',
+            )
+        finally:
+            rest.router.register_serializer(Parent, original)
+        self.assertEqual(
+            rest.router.get_viewset_for_model(Parent).lookup_field, 'pk'
+        )
+
+    def test_rest_object_id(self):
+        from wq.db.rest.models import get_object_id, get_by_identifier
+        slugmodel = SlugModel.objects.create(code="test", name="Test")
+        parent = Parent.objects.create(name="Test")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_object_id(slugmodel), "test")
+            self.assertEqual(get_object_id(parent), parent.pk)
+        self.assertEqual(
+            get_by_identifier(SlugModel.objects, "test"), slugmodel
+        )
+
+    def test_rest_user_config_cache(self):
+        from wq.db import rest
+        from django.contrib.auth.models import Permission
+        user1 = User.objects.create(username="user1")
+        user2 = User.objects.create(username="user2")
+
+        # Users with the same permissions share a config
+        config = rest.router.get_config(user1)
+        self.assertIs(config, rest.router.get_config(user2))
+        self.assertNotIn('can_add', config['pages']['parent'])
+
+        # Permission changes produce a new config
+        user1.user_permissions.add(
+            Permission.objects.get(codename='add_parent')
+        )
+        user1 = User.objects.get(pk=user1.pk)
+        new_config = rest.router.get_config(user1)
+        self.assertIsNot(config, new_config)
+        self.assertTrue(new_config['pages']['parent']['can_add'])
+        self.assertNotIn(
+            'can_add', rest.router.get_config(user2)['pages']['parent']
+        )
+
 
 class RestPostTestCase(APITestCase):
     def setUp(self):
@@ -316,6 +811,212 @@ class RestPostTestCase(APITestCase):
         self.assertEqual(geom.x, -90)
         self.assertEqual(geom.y, 44)
 
+    def test_rest_geometry_fragment(self):
+        from wq.db.rest.renderers import RawJSON
+        instance = GeometryModel.objects.create(
+            name="Geometry Test", geometry="POINT(-93.5 44.25)"
+        )
+        response = self.client.get('/geometrymodels/%s.json' % instance.pk)
+        self.assertTrue(status.is_success(response.status_code))
+
+        # Geometry is encoded by the database and spliced in by the renderer
+        self.assertIsInstance(response.data['geometry'], RawJSON)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['geometry'], {
+            'type': 'Point',
+            'coordinates': [-93.5, 44.25],
+        })
+
+    def test_rest_geometry_serializer_data(self):
+        from wq.db import rest
+        instance = GeometryModel.objects.create(
+            name="Geometry Test", geometry="POINT(-93.5 44.25)"
+        )
+        expected = {'type': 'Point', 'coordinates': [-93.5, 44.25]}
+
+        # Outside of wq.db's JSON renderers, geometries are plain dicts
+        serializer = rest.router.get_serializer_for_model(GeometryModel)
+        self.assertEqual(serializer(instance).data['geometry'], expected)
+        self.assertEqual(
+            rest.router.serialize(instance)['geometry'], expected
+        )
+
+    def test_rest_geometry_put(self):
+        instance = GeometryModel.objects.create(
+            name="Geometry Test", geometry="POINT(-93.5 44.25)"
+        )
+        response = self.client.put(
+            '/geometrymodels/%s.json' % instance.pk, {
+                'name': "Geometry Test",
+                'geometry': json.dumps({
+                    "type": "Point",
+                    "coordinates": [-90, 44]
+                }),
+            }
+        )
+        self.assertTrue(status.is_success(response.status_code))
+
+        # Response contains the updated geometry
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['geometry'], {
+            'type': 'Point',
+            'coordinates': [-90, 44],
+        })
+        instance.refresh_from_db()
+        self.assertEqual(instance.geometry.coords, (-90, 44))
+
+    def test_rest_geometry_simplify(self):
+        import math
+        points = [
+            '%s %s' % (
+                -93 + 0.5 * math.cos(2 * math.pi * i / 2000),
+                45 + 0.5 * math.sin(2 * math.pi * i / 2000),
+            ) for i in range(2000)
+        ]
+        instance = GeometryModel.objects.create(
+            name="Detailed Polygon",
+            geometry="POLYGON((%s))" % ', '.join(points + points[:1]),
+        )
+
+        def get_geometry(url):
+            response = self.client.get(url)
+            self.assertTrue(
+                status.is_success(response.status_code), response.data
+            )
+            data = json.loads(response.content.decode('utf-8'))
+            if 'features' in data:
+                data = data['features'][0]
+            return len(response.content), data['geometry']
+
+        url = '/geometrymodels/%s.geojson' % instance.pk
+        full_size, full = get_geometry(url)
+        self.assertEqual(len(full['coordinates'][0]), 2001)
+
+        size, geometry = get_geometry(url + '?tolerance=0.01&precision=4')
+        self.assertEqual(geometry['type'], 'Polygon')
+        self.assertLess(len(geometry['coordinates'][0]), 100)
+        self.assertLess(size * 10, full_size)
+        for x, y in geometry['coordinates'][0]:
+            self.assertEqual(round(x, 4), x)
+            self.assertEqual(round(y, 4), y)
+
+        # List views (rendered in the database for this model) and zoom
+        size, geometry = get_geometry('/geometrymodels.geojson?zoom=6')
+        self.assertLess(len(geometry['coordinates'][0]), 2001)
+        self.assertLess(size, full_size)
+
+        response = self.client.get(url + '?tolerance=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for zoom in '5000', '-1':
+            response = self.client.get(url + '?zoom=' + zoom)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+    def test_rest_zoom_tolerance(self):
+        """
+        Zoom tolerances should be converted to the units of the SRID.
+        """
+        from wq.db.rest.serializers import get_zoom_tolerance
+        meters = get_zoom_tolerance(10, 3857)
+        # UTM zone 15N (meters)
+        self.assertAlmostEqual(get_zoom_tolerance(10, 26915), meters)
+        # Texas North Central (US survey feet)
+        self.assertAlmostEqual(
+            get_zoom_tolerance(10, 2276), meters / 0.3048006096012192,
+            places=3,
+        )
+        # NAD83 (degrees)
+        self.assertAlmostEqual(
+            get_zoom_tolerance(10, 4269), 360.0 / (256 * 2 ** 10)
+        )
+        with self.assertRaises(ValueError):
+            get_zoom_tolerance(10, 999999)
+
+    def test_rest_topojson(self):
+        """
+        TopoJSON output should store boundaries shared by adjacent polygons
+        only once, and be smaller than the equivalent GeoJSON.
+        """
+        def edge(x0, y0, x1, y1):
+            return [
+                '%s %s' % (
+                    x0 + (x1 - x0) * i / 20.0, y0 + (y1 - y0) * i / 20.0
+                ) for i in range(20)
+            ]
+
+        GeometryModel.objects.all().delete()
+        for i in range(3):
+            for j in range(3):
+                x, y = -93 + i * 0.1, 45 + j * 0.1
+                points = (
+                    edge(x, y, x + 0.1, y) +
+                    edge(x + 0.1, y, x + 0.1, y + 0.1) +
+                    edge(x + 0.1, y + 0.1, x, y + 0.1) +
+                    edge(x, y + 0.1, x, y)
+                )
+                GeometryModel.objects.create(
+                    name="Cell %s %s" % (i, j),
+                    geometry="POLYGON((%s))" % ', '.join(points + points[:1]),
+                )
+
+        response = self.client.get(
+            '/geometrymodels?format=topojson',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        topology = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(topology['type'], 'Topology')
+        self.assertEqual(topology['count'], 9)
+        self.assertIn('scale', topology['transform'])
+        geometries = topology['objects']['geometrymodel']['geometries']
+        self.assertEqual(len(geometries), 9)
+        for geometry in geometries:
+            self.assertEqual(geometry['type'], 'Polygon')
+            self.assertTrue(geometry['properties']['name'].startswith('Cell'))
+
+        # 12 shared interior edges, and the outer boundary split into 8 arcs
+        # where the interior edges meet it
+        self.assertEqual(len(topology['arcs']), 20)
+
+        geojson = self.client.get(
+            '/geometrymodels.geojson',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertLess(len(response.content) * 2, len(geojson.content))
+
+    def test_rest_topojson_tiny_polygon(self):
+        """
+        Polygons smaller than the quantization grid should be dropped
+        rather than causing an error.
+        """
+        GeometryModel.objects.all().delete()
+        GeometryModel.objects.create(
+            name="Large",
+            geometry="POLYGON((-94 44, -92 44, -92 46, -94 46, -94 44))",
+        )
+        GeometryModel.objects.create(
+            name="Tiny",
+            geometry="POLYGON((-93 45, -92.99999 45, -92.99999 45.00001, "
+                     "-93 45))",
+        )
+        for quantization in ('10', '0', '99999999999999'):
+            response = self.client.get(
+                '/geometrymodels?format=topojson&quantization=%s'
+                % quantization,
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            topology = json.loads(response.content.decode('utf-8'))
+            geometries = {
+                geometry['properties']['name']: geometry['type']
+                for geometry
+                in topology['objects']['geometrymodel']['geometries']
+            }
+            self.assertEqual(geometries['Large'], 'Polygon')
+            if quantization == '10':
+                self.assertIsNone(geometries['Tiny'])
+
     def test_rest_geometry_post_wkt(self):
         """
         Posting WKT to a model with a geometry field should work.
@@ -368,3 +1069,164 @@ class RestPostTestCase(APITestCase):
         self.assertEqual(
             response.status_code, status.HTTP_201_CREATED, response.data
         )
+
+    def test_rest_batch(self):
+        itype = ItemType.objects.create(name="Batch", pk=10)
+        item = itype.item_set.create(name="Existing")
+        operations = [{
+            'model': 'items',
+            'local_id': 'outbox-1',
+            'data': {'name': "Batch 1", 'type_id': itype.pk},
+        }, {
+            'model': 'items',
+            'local_id': 'outbox-2',
+            'data': {'name': "Batch 2", 'type_id': itype.pk},
+        }, {
+            'model': 'items',
+            'id': item.pk,
+            'data': {'name': "Updated", 'type_id': itype.pk},
+        }]
+        response = self.client.post(
+            '/batch.json', operations, format='json'
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK, response.data
+        )
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['local_id'], 'outbox-1')
+        self.assertEqual(results[0]['status'], status.HTTP_201_CREATED)
+        self.assertEqual(
+            itype.item_set.get(pk=results[1]['id']).name, "Batch 2"
+        )
+        self.assertEqual(results[2]['status'], status.HTTP_200_OK)
+        self.assertEqual(results[2]['data']['label'], "Updated")
+        self.assertEqual(itype.item_set.get(pk=item.pk).name, "Updated")
+
+    def test_rest_batch_invalid(self):
+        itype = ItemType.objects.create(name="Batch", pk=10)
+        operations = [{
+            'model': 'items',
+            'data': {'name': "Batch 1", 'type_id': itype.pk},
+        }, {
+            'model': 'items',
+            'data': {'name': "Batch 2 - name too long"},
+        }]
+        response = self.client.post(
+            '/batch.json', operations, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        results = response.data['results']
+        self.assertEqual(results[0]['status'], status.HTTP_201_CREATED)
+        self.assertIn('name', results[1]['errors'])
+        self.assertIn('type_id', results[1]['errors'])
+        self.assertFalse(itype.item_set.exists())
+
+    def test_rest_batch_hooks(self):
+        from wq.db import rest
+        from django.db import DatabaseError, IntegrityError
+        itype = ItemType.objects.create(name="Batch", pk=10)
+        item = itype.item_set.create(name="Existing")
+        viewset = rest.router.get_viewset_for_model(Item)
+
+        def perform_create(self, serializer):
+            if serializer.validated_data['name'] == "Conflict":
+                raise IntegrityError("duplicate key")
+            if serializer.validated_data['name'] == "Broken":
+                raise DatabaseError("connection lost")
+            serializer.save(name=serializer.validated_data['name'] + "!")
+
+        def perform_update(self, serializer):
+            serializer.save(name="Hooked")
+
+        viewset.perform_create = perform_create
+        viewset.perform_update = perform_update
+        try:
+            operations = [{
+                'model': 'items',
+                'data': {'name': "Batch 1", 'type_id': itype.pk},
+            }, {
+                'model': 'items',
+                'data': {'name': "Batch 2", 'type_id': itype.pk},
+            }, {
+                'model': 'items',
+                'id': item.pk,
+                'data': {'name': "Updated", 'type_id': itype.pk},
+            }]
+            response = self.client.post(
+                '/batch.json', operations, format='json'
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_200_OK, response.data
+            )
+            self.assertEqual(
+                sorted(itype.item_set.values_list('name', flat=True)),
+                ["Batch 1!", "Batch 2!", "Hooked"],
+            )
+
+            # Database errors are reported per operation
+            operations[1]['data']['name'] = "Conflict"
+            response = self.client.post(
+                '/batch.json', operations, format='json'
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            results = response.data['results']
+            self.assertEqual(results[0]['status'], status.HTTP_201_CREATED)
+            self.assertEqual(
+                results[1]['status'], status.HTTP_400_BAD_REQUEST
+            )
+            self.assertNotIn('duplicate', results[1]['errors']['detail'])
+            self.assertEqual(itype.item_set.count(), 3)
+
+            # Other database errors are also reported per operation
+            operations[1]['data']['name'] = "Broken"
+            response = self.client.post(
+                '/batch.json', operations, format='json'
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            results = response.data['results']
+            self.assertEqual(
+                results[1]['status'], status.HTTP_400_BAD_REQUEST
+            )
+            self.assertEqual(itype.item_set.count(), 3)
+        finally:
+            del viewset.perform_create
+            del viewset.perform_update
+
+    def test_rest_batch_permissions(self):
+        from wq.db import rest
+        from rest_framework.permissions import BasePermission
+        itype = ItemType.objects.create(name="Batch", pk=10)
+        item = itype.item_set.create(name="Locked")
+        viewset = rest.router.get_viewset_for_model(Item)
+
+        class NoCreate(BasePermission):
+            def has_permission(self, request, view):
+                return request.method != 'POST'
+
+            def has_object_permission(self, request, view, obj):
+                return obj.name != "Locked"
+
+        permission_classes = viewset.permission_classes
+        viewset.permission_classes = list(permission_classes) + [NoCreate]
+        try:
+            response = self.client.post('/batch.json', [{
+                'model': 'items',
+                'data': {'name': "Batch 1", 'type_id': itype.pk},
+            }, {
+                'model': 'items',
+                'id': item.pk,
+                'data': {'name': "Updated", 'type_id': itype.pk},
+            }], format='json')
+        finally:
+            viewset.permission_classes = permission_classes
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        results = response.data['results']
+        self.assertEqual(results[0]['status'], status.HTTP_403_FORBIDDEN)
+        self.assertEqual(results[1]['status'], status.HTTP_403_FORBIDDEN)
+        self.assertFalse(itype.item_set.filter(name="Batch 1").exists())
+        self.assertEqual(itype.item_set.get().name, "Locked")